@@ -1,13 +1,23 @@
 """Admin routes"""
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from datetime import datetime, timezone
-from typing import List
-from backend.database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, and_, or_
+from datetime import datetime
+from typing import Optional
+from backend.database import get_db, pool_stats
 from backend.models import User, Message
-from backend.schemas import TopicUpdate, MessageDelete, UserBan
+from backend.schemas import TopicUpdate, UserBan
 from backend.auth import get_current_admin_user
+from backend.rooms import rooms, supervisor
+from backend.persistence import message_writer
+from backend.broker import broker
+from backend import ratelimit
+from backend.auth_cache import auth_cache
+from backend.rollover import rollover
+from backend.totals import totals
+from backend.health import readiness
+import base64
+import json
 import os
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
@@ -15,31 +25,40 @@ router = APIRouter(prefix="/api/admin", tags=["admin"])
 
 @router.get("/stats")
 async def get_statistics(
-    db: Session = Depends(get_db),
+    room: Optional[str] = None,
     current_user: User = Depends(get_current_admin_user)
 ):
-    """Get application statistics (admin only)"""
-    total_users = db.query(func.count(User.id)).scalar()
-    total_messages = db.query(func.count(Message.id)).scalar()
-
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
-    today_messages = db.query(func.count(Message.id)).filter(
-        Message.date_created == today
-    ).scalar()
+    """Get application statistics, optionally for one room (admin only)"""
+    # Running totals, so this costs no queries however large the tables get
+    counts = totals.counts(room)
 
     return {
-        "total_users": total_users,
-        "total_messages": total_messages,
-        "today_messages": today_messages,
+        "room": room,
+        "total_users": counts["users"],
+        "total_messages": counts["messages_total"],
+        "today_messages": counts["messages_today"],
+        "peak_clients": totals.peak_clients,
+        "top_users": totals.top_users(),
         "current_topic": os.getenv("DAILY_TOPIC", "No topic set"),
-        "current_rules": os.getenv("DAILY_RULES", "")
+        "current_rules": os.getenv("DAILY_RULES", ""),
+        "connections": rooms.connection_stats(),
+        "rooms": rooms.stats(),
+        "liveness": supervisor.stats(),
+        "rate_limits": ratelimit.stats(),
+        "auth_cache": auth_cache.stats(),
+        "database": pool_stats(),
+        "persistence": message_writer.stats(),
+        "rollover": rollover.stats(),
+        "totals": totals.stats(),
+        "readiness": readiness.stats(),
+        "broker": broker.stats()
     }
 
 
 @router.post("/topic")
 async def update_topic(
     topic_data: TopicUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_admin_user)
 ):
     """Update daily topic (admin only)"""
@@ -60,70 +79,159 @@ async def update_topic(
 @router.delete("/message/{message_id}")
 async def delete_message(
     message_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_admin_user)
 ):
     """Delete a specific message (admin only)"""
-    message = db.query(Message).filter(Message.id == message_id).first()
+    message = await db.get(Message, message_id)
 
-    if not message:
+    # A just-sent message may still be waiting in a worker's write queue
+    found = message
+    if found is None:
+        room = rooms.find_message(message_id)
+        found = room.history.by_id[message_id] if room is not None else None
+    if found is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Message not found"
         )
 
-    db.delete(message)
-    db.commit()
+    # Evict from every worker's history and totals and cancel any pending write
+    await broker.publish({
+        "type": "evict",
+        "id": message_id,
+        "room": found.room,
+        "user": found.user,
+        "date_created": found.date_created,
+        "stored": message is not None,
+        # The worker whose writer is saving it
+        "writer": found.origin if message is None else None
+    })
+
+    if message:
+        await db.delete(message)
+        await db.commit()
 
     return {"message": "Message deleted successfully"}
 
 
+def _encode_cursor(**position) -> str:
+    """Opaque page cursor: the sort key of the last row on the page"""
+    return base64.urlsafe_b64encode(json.dumps(position, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(position, dict):
+            raise ValueError
+        return position
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
 @router.get("/messages")
 async def get_all_messages(
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db),
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    room: Optional[str] = None,
+    date: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$"),
+    user: Optional[str] = None,
+    user_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_admin_user)
 ):
-    """Get all messages with pagination (admin only)"""
-    messages = db.query(Message).order_by(
-        Message.timestamp.desc()
-    ).offset(skip).limit(limit).all()
-
-    return [
-        {
-            "id": msg.id,
-            "user": msg.user,
-            "text": msg.text,
-            "timestamp": msg.timestamp.isoformat(),
-            "date_created": msg.date_created,
-            "user_id": msg.user_id
-        }
-        for msg in messages
-    ]
+    """Messages newest first, one page at a time (admin only)
+
+    Pass the returned next_cursor to get the following page. Pages are
+    keyed on (timestamp, id), so messages arriving meanwhile don't shift
+    them, and each page costs the same however deep it is. Reads what is
+    in the table; messages the writer hasn't saved yet (at most
+    PERSIST_FLUSH_INTERVAL seconds old) show up on the next refresh.
+    """
+    query = select(Message)
+    if room:
+        query = query.where(Message.room == room)
+    if date:
+        query = query.where(Message.date_created == date)
+    if user:
+        query = query.where(Message.user == user)
+    if user_id is not None:
+        query = query.where(Message.user_id == user_id)
+    if cursor:
+        position = _decode_cursor(cursor)
+        try:
+            after_timestamp = datetime.fromisoformat(position["t"])
+            after_id = int(position["i"])
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        query = query.where(or_(
+            Message.timestamp < after_timestamp,
+            and_(Message.timestamp == after_timestamp, Message.id < after_id)
+        ))
+
+    result = await db.execute(
+        query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1)
+    )
+    messages = result.scalars().all()
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        last = messages[-1]
+        next_cursor = _encode_cursor(t=last.timestamp.isoformat(), i=last.id)
+
+    return {
+        "items": [
+            {
+                "id": msg.id,
+                "user": msg.user,
+                "text": msg.text,
+                "timestamp": msg.timestamp.isoformat(),
+                "date_created": msg.date_created,
+                "user_id": msg.user_id,
+                "room": msg.room
+            }
+            for msg in messages
+        ],
+        "next_cursor": next_cursor
+    }
 
 
 @router.get("/users")
 async def get_all_users(
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db),
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_admin_user)
 ):
-    """Get all users (admin only)"""
-    users = db.query(User).offset(skip).limit(limit).all()
+    """Users in sign-up order, one page at a time (admin only)"""
+    query = select(User)
+    if cursor:
+        try:
+            after_id = int(_decode_cursor(cursor)["i"])
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        query = query.where(User.id > after_id)
+
+    result = await db.execute(query.order_by(User.id).limit(limit + 1))
+    users = result.scalars().all()
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = _encode_cursor(i=users[-1].id)
 
-    return [user.to_dict() for user in users]
+    return {"items": [user.to_dict() for user in users], "next_cursor": next_cursor}
 
 
 @router.post("/user/ban")
 async def ban_user(
     ban_data: UserBan,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_admin_user)
 ):
     """Ban or unban a user (admin only)"""
-    user = db.query(User).filter(User.id == ban_data.user_id).first()
+    user = await db.get(User, ban_data.user_id)
 
     if not user:
         raise HTTPException(
@@ -138,7 +246,10 @@ async def ban_user(
         )
 
     user.is_active = not ban_data.ban
-    db.commit()
+    await db.commit()
+
+    # Drop the cached snapshot on every worker so the ban applies at once
+    await broker.publish({"type": "user_changed", "id": user.id, "is_active": user.is_active})
 
     action = "banned" if ban_data.ban else "unbanned"
     return {"message": f"User {user.username} has been {action}"}
@@ -146,12 +257,21 @@ async def ban_user(
 
 @router.delete("/clear-messages")
 async def clear_all_messages(
-    db: Session = Depends(get_db),
+    room: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_admin_user)
 ):
-    """Clear all messages (admin only)"""
-    count = db.query(Message).delete()
-    db.commit()
+    """Clear all messages, or just one room's (admin only)"""
+    # Empty every worker's history and write queue, then the table; the
+    # messages this worker hadn't written yet are counted too
+    discarded = message_writer.discard(room)
+    await broker.publish({"type": "clear", "room": room})
+    query = delete(Message)
+    if room:
+        query = query.where(Message.room == room)
+    result = await db.execute(query)
+    await db.commit()
+    count = result.rowcount + discarded
 
     return {"message": f"Cleared {count} messages"}
 
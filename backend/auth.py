@@ -1,15 +1,27 @@
 """Authentication utilities"""
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from typing import Optional
+import asyncio
+import logging
+import time
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 import bcrypt as bcrypt_lib
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from backend.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from backend.config import (
+    SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, BCRYPT_ROUNDS,
+    PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE
+)
 from backend.database import get_db
 from backend.models import User
+from backend.auth_cache import auth_cache, UserSnapshot
+from backend.metrics import Gauge, Histogram
+
+logger = logging.getLogger(__name__)
 
 # Password hashing - use bcrypt directly to avoid passlib initialization issues
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -17,6 +29,18 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 # JWT bearer scheme - auto_error=False to handle errors ourselves
 security = HTTPBearer(auto_error=False)
 
+# bcrypt takes ~100-300 ms of CPU; it runs on these threads (it releases
+# the GIL), never on the event loop
+_password_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_password_slots = asyncio.Semaphore(PASSWORD_HASH_WORKERS)
+_password_waiting = 0
+
+PASSWORD_QUEUE = Gauge("rageroom_password_hash_queue", "Password hash/verify calls waiting for a thread")
+PASSWORD_QUEUE.set_function(lambda: _password_waiting)
+PASSWORD_SECONDS = Histogram(
+    "rageroom_password_hash_seconds", "Time spent hashing or verifying a password, including the wait", ["op"]
+)
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against a hash
@@ -60,17 +84,55 @@ def get_password_hash(password: str) -> str:
     
     # Use bcrypt directly to avoid passlib initialization issues with long passwords
     # Generate salt and hash
-    salt = bcrypt_lib.gensalt()
+    salt = bcrypt_lib.gensalt(rounds=BCRYPT_ROUNDS)
     hashed = bcrypt_lib.hashpw(password.encode('utf-8'), salt)
     # Return as string (bcrypt format compatible with passlib)
     return hashed.decode('utf-8')
 
 
+def needs_rehash(hashed_password: str) -> bool:
+    """True if a bcrypt hash was made with a different cost than BCRYPT_ROUNDS"""
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+async def _run_password_job(op: str, func, *args):
+    """Run a bcrypt call on the password pool, capping how many may wait"""
+    global _password_waiting
+    if _password_waiting >= PASSWORD_HASH_MAX_QUEUE:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy. Please try again shortly.",
+            headers={"Retry-After": "1"}
+        )
+
+    started = time.perf_counter()
+    _password_waiting += 1
+    try:
+        await _password_slots.acquire()
+    finally:
+        _password_waiting -= 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_password_pool, func, *args)
+    finally:
+        _password_slots.release()
+        PASSWORD_SECONDS.labels(op).observe(time.perf_counter() - started)
+
+
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    """verify_password off the event loop"""
+    return await _run_password_job("verify", verify_password, plain_password, hashed_password)
+
+
+async def hash_password(password: str) -> str:
+    """get_password_hash off the event loop"""
+    return await _run_password_job("hash", get_password_hash, password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token"""
-    import logging
-    logger = logging.getLogger(__name__)
-    
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.now(timezone.utc) + expires_delta
@@ -84,90 +146,57 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     if isinstance(encoded_jwt, bytes):
         encoded_jwt = encoded_jwt.decode('utf-8')
     
-    logger.info(f"Token created for user_id: {data.get('sub')}, expires: {expire}, token length: {len(encoded_jwt)}")
+    logger.debug(f"Token created for user_id: {data.get('sub')}, expires: {expire}")
     return encoded_jwt
 
 
 def decode_access_token(token: str) -> Optional[dict]:
     """Decode and validate a JWT token"""
-    import logging
-    logger = logging.getLogger(__name__)
-    
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        logger.info(f"Token decoded successfully, user_id: {payload.get('sub')}")
+        logger.debug(f"Token decoded successfully, user_id: {payload.get('sub')}")
         return payload
     except JWTError as e:
-        logger.warning(f"JWT decode error: {e}, token preview: {token[:20]}...")
+        # Never log the token itself, not even a prefix
+        logger.debug(f"JWT decode error: {e}")
         return None
     except Exception as e:
         logger.error(f"Unexpected error decoding token: {e}")
         return None
 
 
-def get_current_user(
+async def get_current_user(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
-    """Get the current authenticated user from JWT token"""
-    import logging
-    logger = logging.getLogger(__name__)
-    
+    db: AsyncSession = Depends(get_db)
+) -> UserSnapshot:
+    """Get the current authenticated user from JWT token
+
+    Verified tokens and user snapshots come from auth_cache, so repeat
+    requests skip the JWT decode and the database lookup.
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
+
     if credentials is None:
-        logger.warning("No authorization credentials provided")
-        raise credentials_exception
-    
-    try:
-        token = credentials.credentials
-        logger.info(f"Received token, length: {len(token)}, preview: {token[:30]}...")
-    except Exception as e:
-        logger.error(f"Failed to get credentials: {e}")
+        logger.debug("No authorization credentials provided")
         raise credentials_exception
 
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-
     try:
-        payload = decode_access_token(token)
-        if payload is None:
-            logger.warning("Failed to decode JWT token - token may be invalid or expired")
-            raise credentials_exception
-
-        user_id_str = payload.get("sub")
-        if user_id_str is None:
-            logger.warning("JWT token missing user_id in payload")
-            raise credentials_exception
-        
-        # Convert string back to integer
-        try:
-            user_id = int(user_id_str)
-        except (ValueError, TypeError) as e:
-            logger.error(f"Invalid user_id format in token: {user_id_str}, error: {e}")
-            raise credentials_exception
-
-        logger.info(f"Looking up user with id: {user_id}")
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await user_for_token(credentials.credentials, db)
         if user is None:
-            logger.error(f"User with id {user_id} not found in database")
             raise credentials_exception
 
         if not user.is_active:
-            logger.warning(f"User {user_id} is inactive")
+            logger.warning(f"User {user.id} is inactive")
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="User account is inactive"
             )
 
-        logger.info(f"Successfully authenticated user: {user.email}")
+        logger.debug(f"Authenticated user: {user.email}")
         return user
     except HTTPException:
         raise
@@ -176,14 +205,49 @@ def get_current_user(
         raise credentials_exception
 
 
-def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
+async def user_for_token(token: str, db: AsyncSession) -> Optional[UserSnapshot]:
+    """Snapshot of the user a token belongs to, active or not (None if invalid)"""
+    user_id = auth_cache.token_user_id(token)
+    if user_id is None:
+        user_id = user_id_from_token(token)
+        if user_id is None:
+            return None
+
+    user = auth_cache.user(user_id)
+    if user is None:
+        db_user = await db.get(User, user_id)
+        if db_user is None:
+            logger.error(f"User with id {user_id} not found in database")
+            return None
+        user = auth_cache.remember_user(db_user)
+    return user
+
+
+def user_id_from_token(token: str) -> Optional[int]:
+    """Decode a JWT and return its user id, caching the verified token"""
+    payload = decode_access_token(token)
+    if payload is None:
+        logger.debug("Failed to decode JWT token - token may be invalid or expired")
+        return None
+
+    try:
+        user_id = int(payload.get("sub"))
+    except (ValueError, TypeError):
+        logger.error(f"Invalid user_id in token: {payload.get('sub')}")
+        return None
+
+    auth_cache.remember_token(token, user_id, payload.get("exp"))
+    return user_id
+
+
+def get_current_active_user(current_user: UserSnapshot = Depends(get_current_user)) -> UserSnapshot:
     """Get the current active user"""
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
 
-def get_current_admin_user(current_user: User = Depends(get_current_user)) -> User:
+def get_current_admin_user(current_user: UserSnapshot = Depends(get_current_user)) -> UserSnapshot:
     """Get the current admin user"""
     if not current_user.is_admin:
         raise HTTPException(
@@ -193,12 +257,21 @@ def get_current_admin_user(current_user: User = Depends(get_current_user)) -> Us
     return current_user
 
 
-def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
-    """Authenticate a user by email and password"""
-    user = db.query(User).filter(User.email == email).first()
+async def authenticate_user(db: AsyncSession, email: str, password: str) -> Optional[User]:
+    """Authenticate a user by email and password
+
+    A hash made with an old BCRYPT_ROUNDS is replaced while we have the
+    plain password at hand.
+    """
+    user = await db.scalar(select(User).where(User.email == email))
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    if not await check_password(password, user.hashed_password):
         return None
+
+    if needs_rehash(user.hashed_password):
+        user.hashed_password = await hash_password(password)
+        await db.commit()
+        logger.info(f"Upgraded password hash for user_id: {user.id}")
     return user
 
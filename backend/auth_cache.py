@@ -0,0 +1,134 @@
+"""Cache of verified tokens and user snapshots for the auth hot path"""
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Optional
+import time
+from backend.config import AUTH_CACHE_SIZE, AUTH_CACHE_TTL
+from backend.models import User
+
+
+class TTLCache:
+    """LRU mapping whose entries also expire after a deadline"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries: "OrderedDict[Any, tuple]" = OrderedDict()  # key -> (value, expires_at)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value, expires_at: Optional[float] = None):
+        """Store a value until `expires_at` (epoch seconds) or the TTL, whichever is sooner"""
+        deadline = time.time() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        self.entries[key] = (value, deadline)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def pop(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+class UserSnapshot:
+    """Read-only copy of the User columns the auth checks and routes need"""
+    __slots__ = ("id", "email", "username", "is_admin", "is_active", "created_at")
+
+    def __init__(self, id: int, email: str, username: str, is_admin: bool,
+                 is_active: bool, created_at: datetime):
+        self.id = id
+        self.email = email
+        self.username = username
+        self.is_admin = is_admin
+        self.is_active = is_active
+        self.created_at = created_at
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserSnapshot":
+        return cls(
+            id=user.id,
+            email=user.email,
+            username=user.username,
+            is_admin=user.is_admin,
+            is_active=user.is_active,
+            created_at=user.created_at
+        )
+
+    def to_dict(self) -> dict:
+        """Same shape as User.to_dict"""
+        return {
+            "id": self.id,
+            "email": self.email,
+            "username": self.username,
+            "is_admin": self.is_admin,
+            "created_at": self.created_at.isoformat()
+        }
+
+
+class AuthCache:
+    """Verified token -> user id, and user id -> snapshot with active/admin flags
+
+    A token entry lives until the TTL or the token's own expiry. Changing a
+    user (ban, unban, role change) must call invalidate_user on every
+    worker, which the "user_changed" broker event does; the next request
+    then reads the user from the database again.
+    """
+
+    def __init__(self, maxsize: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL):
+        self.tokens = TTLCache(maxsize, ttl)
+        self.users = TTLCache(maxsize, ttl)
+        self.invalidations = 0
+
+    def token_user_id(self, token: str) -> Optional[int]:
+        return self.tokens.get(token)
+
+    def remember_token(self, token: str, user_id: int, expires_at: Optional[float] = None):
+        self.tokens.set(token, user_id, expires_at)
+
+    def user(self, user_id: int) -> Optional[UserSnapshot]:
+        return self.users.get(user_id)
+
+    def remember_user(self, user: User) -> UserSnapshot:
+        snapshot = UserSnapshot.from_user(user)
+        self.users.set(user.id, snapshot)
+        return snapshot
+
+    def invalidate_user(self, user_id: int):
+        self.users.pop(user_id)
+        self.invalidations += 1
+
+    def clear(self):
+        self.tokens.clear()
+        self.users.clear()
+
+    def stats(self) -> dict:
+        return {
+            "tokens": self.tokens.stats(),
+            "users": self.users.stats(),
+            "invalidations": self.invalidations,
+        }
+
+
+# Shared cache for this process
+auth_cache = AuthCache()
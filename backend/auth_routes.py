@@ -1,13 +1,16 @@
 """Authentication routes"""
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import SQLAlchemyError
 import logging
 from backend.database import get_db
+from backend.broker import broker
 from backend.models import User
 from backend.schemas import UserCreate, UserLogin, Token, UserResponse
+from backend.ratelimit import rate_limit
 from backend.auth import (
-    get_password_hash,
+    hash_password,
     authenticate_user,
     create_access_token,
     get_current_active_user
@@ -17,12 +20,17 @@ logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/auth", tags=["authentication"])
 
 
-@router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def register(user_data: UserCreate, db: Session = Depends(get_db)):
+@router.post(
+    "/register",
+    response_model=UserResponse,
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(rate_limit("register"))]
+)
+async def register(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
     """Register a new user"""
     try:
         # Check if email already exists
-        existing_user = db.query(User).filter(User.email == user_data.email).first()
+        existing_user = await db.scalar(select(User).where(User.email == user_data.email))
         if existing_user:
             logger.warning(f"Registration attempt with existing email: {user_data.email}")
             raise HTTPException(
@@ -31,7 +39,7 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
             )
 
         # Check if username already exists
-        existing_username = db.query(User).filter(User.username == user_data.username).first()
+        existing_username = await db.scalar(select(User).where(User.username == user_data.username))
         if existing_username:
             logger.warning(f"Registration attempt with existing username: {user_data.username}")
             raise HTTPException(
@@ -41,7 +49,7 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
 
         # Create new user
         # Note: bcrypt truncates passwords > 72 bytes automatically, but we handle it explicitly
-        hashed_password = get_password_hash(user_data.password)
+        hashed_password = await hash_password(user_data.password)
         new_user = User(
             email=user_data.email,
             username=user_data.username,
@@ -51,8 +59,11 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
         )
 
         db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
+        await db.refresh(new_user)
+
+        # Count the new account on every worker
+        await broker.publish({"type": "user_registered", "id": new_user.id})
 
         logger.info(f"New user registered: {user_data.email} (username: {user_data.username})")
         return new_user
@@ -60,25 +71,25 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
         raise
     except SQLAlchemyError as e:
         logger.error(f"Database error during registration: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Database error. Please try again later."
         )
     except Exception as e:
         logger.error(f"Unexpected error during registration: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="An error occurred during registration. Please try again."
         )
 
 
-@router.post("/login", response_model=Token)
-async def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
+@router.post("/login", response_model=Token, dependencies=[Depends(rate_limit("login"))])
+async def login(user_credentials: UserLogin, db: AsyncSession = Depends(get_db)):
     """Login user and return JWT token"""
     try:
-        user = authenticate_user(db, user_credentials.email, user_credentials.password)
+        user = await authenticate_user(db, user_credentials.email, user_credentials.password)
 
         if not user:
             logger.warning(f"Failed login attempt for email: {user_credentials.email}")
@@ -114,7 +125,7 @@ async def login(user_credentials: UserLogin, db: Session = Depends(get_db)):
 async def get_current_user_info(current_user: User = Depends(get_current_active_user)):
     """Get current user information"""
     try:
-        logger.info(f"User info requested for user_id: {current_user.id}")
+        logger.debug(f"User info requested for user_id: {current_user.id}")
         return current_user
     except Exception as e:
         logger.error(f"Error getting user info: {e}")
@@ -0,0 +1,318 @@
+"""Pub/sub broker that fans chat events out to every worker process"""
+from collections import deque
+from typing import Callable, Deque, List, Optional, Set, Tuple
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import struct
+import time
+from backend.config import BROKER, BROKER_SOCKET_PATH, BROKER_PEER_BUFFER, BROKER_PEER_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Events are small JSON dicts with a "type" key. "message" events are
+# numbered by the broker as they pass through it, so message ids are unique
+# and delivered in the same order on every worker.
+EventHandler = Callable[[dict], None]
+Sequence = Callable[[], int]
+
+_HEADER = struct.Struct("!I")
+MAX_BACKLOG = 1000
+
+
+class Broker:
+    """Base broker: publish events, deliver them to a local handler"""
+
+    def __init__(self):
+        self.origin = str(os.getpid())
+        self.handler: Optional[EventHandler] = None
+        self.sequence: Optional[Sequence] = None
+
+    async def start(self, handler: EventHandler, sequence: Sequence):
+        """Start delivering events to `handler`; `sequence` numbers messages"""
+        self.handler = handler
+        self.sequence = sequence
+
+    async def publish(self, event: dict):
+        raise NotImplementedError
+
+    async def stop(self):
+        pass
+
+    def _number(self, event: dict):
+        if event.get("type") == "message" and event.get("id") is None:
+            event["id"] = self.sequence()
+
+    def stats(self) -> dict:
+        return {"broker": self.__class__.__name__}
+
+
+class InProcessBroker(Broker):
+    """Single-process broker: events are delivered straight to the handler"""
+
+    async def publish(self, event: dict):
+        event.setdefault("origin", self.origin)
+        self._number(event)
+        self.handler(event)
+
+
+class UnixSocketBroker(Broker):
+    """Multi-process broker over a local Unix domain socket
+
+    One worker wins an flock on `<path>.lock` and runs a hub on the socket.
+    Every worker, the hub's own included, connects to the hub as a peer. The
+    hub numbers each event and writes it to all peers in one step, so every
+    worker sees the same global order. If the hub's worker exits, the
+    others reconnect and one of them takes over the lock and the hub.
+
+    The hub stamps each event with its epoch and a running number and keeps
+    the last MAX_BACKLOG events. A reconnecting peer says which stamp it saw
+    last, and the hub first sends it whatever it relayed since, so a peer
+    that reconnects after the new hub has started doesn't miss anything.
+
+    Writes to peers are never awaited one by one, so a stalled worker can't
+    hold up the others; a peer with more than `peer_buffer` bytes unsent,
+    or that doesn't drain within `peer_timeout`, is disconnected instead.
+    """
+
+    def __init__(self, path: str = BROKER_SOCKET_PATH, peer_buffer: int = BROKER_PEER_BUFFER,
+                 peer_timeout: float = BROKER_PEER_TIMEOUT):
+        super().__init__()
+        self.path = path
+        self.peer_buffer = peer_buffer
+        self.peer_timeout = peer_timeout
+        self.lock_path = f"{path}.lock"
+        self._lock_fd: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers: List[asyncio.StreamWriter] = []
+        self._peer_tasks: Set[asyncio.Task] = set()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._backlog: List[bytes] = []
+        self._task: Optional[asyncio.Task] = None
+        self._connected = asyncio.Event()
+        self._last_seen: Optional[list] = None  # Hub stamp of the last event received
+        self._epoch: Optional[str] = None  # Set while this worker runs the hub
+        self._stamp = 0
+        self._recent: Deque[Tuple[int, bytes]] = deque(maxlen=MAX_BACKLOG)
+        self.relayed = 0
+        self.reconnects = 0
+        self.kicked = 0
+        self.replayed = 0
+
+    async def start(self, handler: EventHandler, sequence: Sequence):
+        await super().start(handler, sequence)
+        self._task = asyncio.create_task(self._run())
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout=5)
+        except asyncio.TimeoutError:
+            logger.warning("Broker hub not reachable yet, events will be queued")
+
+    async def publish(self, event: dict):
+        event.setdefault("origin", self.origin)
+        frame = _encode(event)
+        writer = self._writer
+        if writer is None or writer.is_closing():
+            self._queue(frame)
+            return
+        try:
+            writer.write(frame)
+            await writer.drain()
+        except ConnectionError:
+            # The hub went away mid-write; send it to the next one
+            self._queue(frame)
+
+    def _queue(self, frame: bytes):
+        # Hand over on reconnect; bounded so a dead hub can't eat memory
+        if len(self._backlog) >= MAX_BACKLOG:
+            self._backlog.pop(0)
+        self._backlog.append(frame)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._writer:
+            self._writer.close()
+        await self._stop_hub()
+
+    # Peer side
+
+    async def _run(self):
+        while True:
+            if self._lock_fd is None and self._try_lock():
+                await self._start_hub()
+
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except (FileNotFoundError, ConnectionRefusedError):
+                await asyncio.sleep(0.2)
+                continue
+
+            self._writer = writer
+            self._connected.set()
+            writer.write(_encode({"type": "hello", "reconnect": self.reconnects > 0, "hub": self._last_seen}))
+            backlog, self._backlog = self._backlog, []
+            for frame in backlog:
+                writer.write(frame)
+
+            try:
+                while True:
+                    event = await _read_event(reader)
+                    self._last_seen = event.pop("hub", self._last_seen)
+                    try:
+                        self.handler(event)
+                    except Exception as e:
+                        logger.error(f"Failed to handle broker event {event.get('type')}: {e}")
+            except (asyncio.IncompleteReadError, ConnectionError):
+                logger.warning("Lost connection to broker hub, reconnecting")
+            finally:
+                self._writer = None
+                self._connected.clear()
+                writer.close()
+            self.reconnects += 1
+            await asyncio.sleep(0.1)
+
+    # Hub side
+
+    def _try_lock(self) -> bool:
+        fd = os.open(self.lock_path, os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def _start_hub(self):
+        # Holding the lock means any existing socket file is stale
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._epoch = f"{self.origin}:{time.time_ns()}"
+        self._stamp = 0
+        self._recent.clear()
+        self._server = await asyncio.start_unix_server(self._serve_peer, path=self.path)
+        logger.info(f"Broker hub started on {self.path} (pid {self.origin})")
+
+    async def _stop_hub(self):
+        if self._server:
+            self._server.close()
+            for peer in self._peers:
+                # Don't wait for unsent events to reach a peer that isn't reading
+                peer.transport.abort()
+            self._server = None
+        if self._peer_tasks:
+            # Closed sockets end them with EOF; cancelling them instead
+            # makes asyncio log a traceback for each
+            tasks = list(self._peer_tasks)
+            done, pending = await asyncio.wait(tasks, timeout=1)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._peer_tasks.add(task)
+        try:
+            self._replay(writer, await _read_event(reader))
+            # No await since the replay, so no event can fall in between
+            self._peers.append(writer)
+            while True:
+                event = await _read_event(reader)
+                self._number(event)
+                self._stamp += 1
+                event["hub"] = [self._epoch, self._stamp]
+                frame = _encode(event)
+                self._recent.append((self._stamp, frame))
+                # Written to every peer before the next event is read
+                for peer in list(self._peers):
+                    if peer.is_closing():
+                        self._peers.remove(peer)
+                    elif peer.transport.get_write_buffer_size() > self.peer_buffer:
+                        self._kick(peer, "too far behind")
+                    else:
+                        peer.write(frame)
+                self.relayed += 1
+                # Slow this publisher down to what the peers can take
+                await asyncio.gather(*(self._drain(peer) for peer in list(self._peers)))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if writer in self._peers:
+                self._peers.remove(writer)
+            writer.close()
+            self._peer_tasks.discard(task)
+
+    def _replay(self, writer: asyncio.StreamWriter, hello: dict):
+        """Send a reconnecting peer the events relayed since the last one it saw"""
+        if not hello.get("reconnect"):
+            return  # A worker that just started loads its state from the database
+        last_seen = hello.get("hub")
+        since = last_seen[1] if last_seen and last_seen[0] == self._epoch else 0
+        missed = [frame for stamp, frame in self._recent if stamp > since]
+        if self._recent and self._recent[0][0] > since + 1:
+            logger.warning("Broker peer reconnected after more events than are kept; some are lost")
+        for frame in missed:
+            writer.write(frame)
+        self.replayed += len(missed)
+
+    async def _drain(self, peer: asyncio.StreamWriter):
+        try:
+            await asyncio.wait_for(peer.drain(), timeout=self.peer_timeout)
+        except asyncio.TimeoutError:
+            self._kick(peer, "not reading")
+        except ConnectionError:
+            pass
+
+    def _kick(self, peer: asyncio.StreamWriter, reason: str):
+        if peer in self._peers:
+            self._peers.remove(peer)
+            self.kicked += 1
+            logger.warning(f"Disconnected broker peer: {reason}")
+        # close() would wait for the unsent events to be read first
+        peer.transport.abort()
+
+    def stats(self) -> dict:
+        return {
+            "broker": self.__class__.__name__,
+            "hub": self._server is not None,
+            "connected": self._writer is not None,
+            "peers": len(self._peers),
+            "relayed": self.relayed,
+            "backlog": len(self._backlog),
+            "reconnects": self.reconnects,
+            "kicked": self.kicked,
+            "replayed": self.replayed,
+        }
+
+
+def _encode(event: dict) -> bytes:
+    body = json.dumps(event).encode("utf-8")
+    return _HEADER.pack(len(body)) + body
+
+
+async def _read_event(reader: asyncio.StreamReader) -> dict:
+    header = await reader.readexactly(_HEADER.size)
+    (length,) = _HEADER.unpack(header)
+    return json.loads(await reader.readexactly(length))
+
+
+def create_broker(kind: str = BROKER) -> Broker:
+    """Build the broker selected by the BROKER setting"""
+    if kind == "memory":
+        return InProcessBroker()
+    if kind == "unix":
+        return UnixSocketBroker()
+    raise ValueError(f"Unknown broker: {kind}")
+
+
+# Shared broker for this process
+broker = create_broker()
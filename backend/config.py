@@ -11,16 +11,204 @@ DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./messages.db")
 if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
+# Connection pool (PostgreSQL)
+# DB_POOL_SIZE connections stay open, up to DB_MAX_OVERFLOW more are opened
+# under load, and a request waits at most DB_POOL_TIMEOUT seconds for one.
+# Connections are replaced after DB_POOL_RECYCLE seconds, and one that sat
+# idle longer than DB_PING_INTERVAL seconds is pinged before reuse
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_PING_INTERVAL = float(os.getenv("DB_PING_INTERVAL", "30"))
+
+# SQLite
+# Every connection uses WAL with synchronous=NORMAL (readers never block the
+# writer) and waits up to SQLITE_BUSY_TIMEOUT_MS for a lock; the message
+# writer and rollover share one dedicated writer connection
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
 # Security
-MAX_MESSAGES_PER_MINUTE = 25
+MAX_MESSAGES_PER_MINUTE = int(os.getenv("MAX_MESSAGES_PER_MINUTE", "25"))
 MAX_MESSAGE_LENGTH = 500
-MAX_CONNECTIONS = 100
+MAX_CONNECTIONS = int(os.getenv("MAX_CONNECTIONS", "100"))
+# New WebSocket connections per client IP (a whole NAT or office shares one)
+WS_CONNECTS_PER_MINUTE = float(os.getenv("WS_CONNECTS_PER_MINUTE", "30"))
+WS_CONNECT_BURST = int(os.getenv("WS_CONNECT_BURST", "20"))
+# Guest messages per client IP and room, on top of each guest's own limit;
+# looser, since everyone behind one NAT or office shares it
+GUEST_MESSAGES_PER_MINUTE_PER_IP = float(os.getenv("GUEST_MESSAGES_PER_MINUTE_PER_IP", "120"))
+
+# Rate limiting
+# Token buckets: each key may burst up to `burst` requests, refilled at
+# `rate` per second. Chat messages and scroll-back pages (ws_history, which
+# may read the DB) have their own buckets in each room, keyed on the
+# signed-in user id or, for guests, the connection; guest messages also
+# share a looser bucket per IP (ws_guest_ip). Connects, logins and
+# registrations are keyed on the client IP. At most RATE_LIMIT_MAX_KEYS keys are tracked (least recently
+# used dropped first), and keys idle for RATE_LIMIT_TTL seconds are forgotten
+RATE_LIMITS = {
+    "ws_message": {"rate": MAX_MESSAGES_PER_MINUTE / 60, "burst": min(MAX_MESSAGES_PER_MINUTE, 10)},
+    "ws_guest_ip": {"rate": GUEST_MESSAGES_PER_MINUTE_PER_IP / 60, "burst": 40},
+    "ws_connect": {"rate": WS_CONNECTS_PER_MINUTE / 60, "burst": WS_CONNECT_BURST},
+    "ws_history": {"rate": 1, "burst": 10},
+    "login": {"rate": 5 / 60, "burst": 5},
+    "register": {"rate": 3 / 3600, "burst": 3},
+}
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "10000"))
+RATE_LIMIT_TTL = float(os.getenv("RATE_LIMIT_TTL", "3600"))
+# "memory" keeps buckets per process; "shared" keeps them in an mmap'd file
+# at RATE_LIMIT_SHM_PATH.<policy> so every uvicorn worker enforces one limit
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_SHM_PATH = os.getenv("RATE_LIMIT_SHM_PATH", "/tmp/rage_room_ratelimit")
+# Take the client IP from X-Forwarded-For (only behind a trusted proxy such as Render's)
+TRUST_PROXY_HEADERS = os.getenv("TRUST_PROXY_HEADERS", "false").lower() == "true"
+
+# WebSocket fan-out
+# Each client gets its own bounded send queue drained by a writer task.
+# Slow consumer policy when a queue is full: "drop_oldest", "coalesce"
+# (merge the queued frames into one batched frame sent as a single array;
+# past WS_COALESCE_MAX_MESSAGES messages the oldest ones are dropped) or
+# "disconnect"
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop_oldest")
+WS_COALESCE_MAX_MESSAGES = int(os.getenv("WS_COALESCE_MAX_MESSAGES", "1000"))
+
+# Liveness
+# Sockets get an app-level {"type": "ping"} every WS_PING_INTERVAL seconds
+# (uvicorn's protocol pings are set separately with --ws-ping-interval and
+# --ws-ping-timeout). Clients that
+# send nothing back within WS_PING_TIMEOUT, or no chat message or
+# scroll-back request (pongs don't count) for WS_IDLE_TIMEOUT seconds
+# (0 disables), are closed to free their slot
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))
+WS_PING_TIMEOUT = float(os.getenv("WS_PING_TIMEOUT", "20"))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "300"))
+
+# Broadcast coalescing
+# When enabled, a room's broadcasts are gathered for a short window and sent
+# as one array frame per client. The window grows from MIN to MAX ms as the
+# room's message rate approaches BROADCAST_BURST_RATE (messages/sec), so a
+# quiet room still sends each message straight away
+BROADCAST_COALESCE = os.getenv("BROADCAST_COALESCE", "false").lower() == "true"
+BROADCAST_WINDOW_MIN_MS = float(os.getenv("BROADCAST_WINDOW_MIN_MS", "0"))
+BROADCAST_WINDOW_MAX_MS = float(os.getenv("BROADCAST_WINDOW_MAX_MS", "50"))
+BROADCAST_BATCH_MAX = int(os.getenv("BROADCAST_BATCH_MAX", "100"))
+BROADCAST_BURST_RATE = float(os.getenv("BROADCAST_BURST_RATE", "50"))
+
+# permessage-deflate tuning, opt-in: only applied when uvicorn runs with
+# --ws backend.ws_protocol:WebSocketProtocol, which is built on uvicorn's
+# deprecated legacy websockets implementation. Otherwise uvicorn's defaults
+# apply (switch compression with --ws-per-message-deflate).
+# Lower level / memLevel / window bits trade bandwidth for CPU and memory per socket
+WS_DEFLATE = os.getenv("WS_DEFLATE", "true").lower() == "true"
+WS_DEFLATE_LEVEL = int(os.getenv("WS_DEFLATE_LEVEL", "6"))
+WS_DEFLATE_MEM_LEVEL = int(os.getenv("WS_DEFLATE_MEM_LEVEL", "5"))
+WS_DEFLATE_WINDOW_BITS = int(os.getenv("WS_DEFLATE_WINDOW_BITS", "12"))
+
+# Rooms
+# Clients join /ws/{room}; plain /ws is the default room. Room names are
+# lowercase letters, digits, "-" and "_", and at most MAX_ROOMS exist at once
+# per worker (a room is removed when its last client leaves)
+DEFAULT_ROOM = "main"
+MAX_ROOMS = int(os.getenv("MAX_ROOMS", "50"))
+
+# History replay
+# New clients get the most recent messages in one frame and page back on scroll
+HISTORY_REPLAY_LIMIT = int(os.getenv("HISTORY_REPLAY_LIMIT", "100"))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+# Today's most recent messages are kept in memory; older pages come from the DB
+HISTORY_BUFFER_SIZE = int(os.getenv("HISTORY_BUFFER_SIZE", "5000"))
+
+# Message persistence
+# Messages are broadcast immediately and written in batches by a background
+# writer once PERSIST_BATCH_SIZE are pending or PERSIST_FLUSH_INTERVAL seconds pass
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "100"))
+PERSIST_FLUSH_INTERVAL = float(os.getenv("PERSIST_FLUSH_INTERVAL", "0.25"))
+# A batch that fails PERSIST_MAX_RETRIES times in a row is written row by row
+# and rows the database rejects are dropped; while the database is down at
+# most PERSIST_MAX_PENDING messages wait, newer ones are not saved
+PERSIST_MAX_RETRIES = int(os.getenv("PERSIST_MAX_RETRIES", "3"))
+PERSIST_MAX_PENDING = int(os.getenv("PERSIST_MAX_PENDING", "10000"))
+
+# Daily rollover
+# The chat day starts at midnight in TIMEZONE (an IANA name such as
+# "Europe/Berlin"; empty means the server's local time). Old messages are
+# deleted ROLLOVER_DELETE_BATCH rows at a time with ROLLOVER_BATCH_PAUSE_MS
+# between batches, so inserts are never blocked for long
+TIMEZONE = os.getenv("TIMEZONE", "")
+ROLLOVER_DELETE_BATCH = int(os.getenv("ROLLOVER_DELETE_BATCH", "1000"))
+ROLLOVER_BATCH_PAUSE_MS = float(os.getenv("ROLLOVER_BATCH_PAUSE_MS", "20"))
+
+# Statistics
+# Totals for the admin dashboard are kept in memory as messages and users come
+# and go, written to the daily_stats table every STATS_SNAPSHOT_INTERVAL
+# seconds and recounted from the database every STATS_RECONCILE_INTERVAL
+STATS_SNAPSHOT_INTERVAL = float(os.getenv("STATS_SNAPSHOT_INTERVAL", "300"))
+STATS_RECONCILE_INTERVAL = float(os.getenv("STATS_RECONCILE_INTERVAL", "3600"))
+STATS_TOP_USERS = int(os.getenv("STATS_TOP_USERS", "10"))
+
+# Health checks
+# /readyz answers from the last result of a background check (database ping and
+# background tasks) run every READINESS_INTERVAL seconds; a result older than
+# READINESS_MAX_AGE counts as not ready
+READINESS_INTERVAL = float(os.getenv("READINESS_INTERVAL", "5"))
+READINESS_TIMEOUT = float(os.getenv("READINESS_TIMEOUT", "2"))
+READINESS_MAX_AGE = float(os.getenv("READINESS_MAX_AGE", "30"))
+
+# Pub/sub broker between worker processes
+# "memory" for a single process, "unix" to run several uvicorn workers on one
+# host (the workers elect a hub on BROKER_SOCKET_PATH)
+BROKER = os.getenv("BROKER", "memory")
+BROKER_SOCKET_PATH = os.getenv("BROKER_SOCKET_PATH", "/tmp/rage_room_broker.sock")
+# The hub disconnects a worker that has more than BROKER_PEER_BUFFER bytes of
+# events waiting to be sent to it, or doesn't read them for
+# BROKER_PEER_TIMEOUT seconds (it reconnects, having missed those events)
+BROKER_PEER_BUFFER = int(os.getenv("BROKER_PEER_BUFFER", str(8 * 1024 * 1024)))
+BROKER_PEER_TIMEOUT = float(os.getenv("BROKER_PEER_TIMEOUT", "5"))
 
 # JWT Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-this-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
 
+# Password hashing
+# bcrypt runs in a thread pool of PASSWORD_HASH_WORKERS threads so it never
+# blocks the event loop; at most PASSWORD_HASH_MAX_QUEUE requests wait for a
+# thread before new ones get 503. Hashes with a different cost than
+# BCRYPT_ROUNDS are upgraded on the user's next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "50"))
+
+# Verified tokens and user snapshots are cached for AUTH_CACHE_TTL seconds
+# (bans and role changes invalidate them right away)
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+
+# Logging
+# Records go through a bounded queue to a background thread, so logging never
+# blocks the event loop (past LOG_QUEUE_SIZE records are dropped and counted).
+# LOG_FORMAT is "json" (one object per line) or "text" for local development.
+# LOG_SAMPLING keeps that fraction of a logger's records below WARNING and
+# LOG_RATE_CAPS caps a logger at that many records per second; both match a
+# logger and its children ("backend.websocket" also covers
+# "backend.websocket.connections")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLING = {
+    "backend.websocket.connections": float(os.getenv("LOG_SAMPLE_CONNECTIONS", "0.1")),
+    "uvicorn.access": float(os.getenv("LOG_SAMPLE_ACCESS", "1.0")),
+}
+LOG_RATE_CAPS = {
+    "backend.websocket.connections": float(os.getenv("LOG_RATE_CAP_CONNECTIONS", "20")),
+    "backend.auth": float(os.getenv("LOG_RATE_CAP_AUTH", "20")),
+    "backend.auth_routes": float(os.getenv("LOG_RATE_CAP_AUTH", "20")),
+    "uvicorn.access": float(os.getenv("LOG_RATE_CAP_ACCESS", "100")),
+}
+
 # Admin Configuration
 ADMIN_EMAIL = os.getenv("ADMIN_EMAIL", "admin@rageroom.com")
 # Note: bcrypt has a 72-byte password limit. Passwords longer than 72 bytes will be automatically truncated.
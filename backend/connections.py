@@ -0,0 +1,373 @@
+"""Connection manager with per-client bounded send queues"""
+from fastapi import WebSocket
+from collections import deque
+from typing import Callable, Deque, Iterable, List, Optional, Set
+import asyncio
+import logging
+import math
+import time
+from backend.config import (
+    WS_SEND_QUEUE_SIZE, WS_SLOW_CONSUMER_POLICY, WS_COALESCE_MAX_MESSAGES, BROADCAST_WINDOW_MIN_MS,
+    BROADCAST_WINDOW_MAX_MS, BROADCAST_BATCH_MAX, BROADCAST_BURST_RATE,
+    WS_PING_INTERVAL, WS_PING_TIMEOUT, WS_IDLE_TIMEOUT
+)
+from backend.frames import Frame
+from backend.metrics import BROADCAST_SECONDS, TASK_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Slow consumer policies
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+DISCONNECT = "disconnect"
+SLOW_CONSUMER_POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+
+class ClientConnection:
+    """A connected WebSocket with its own outbound queue and writer task"""
+
+    def __init__(self, websocket: WebSocket, manager: "ConnectionManager", binary: bool = False):
+        self.websocket = websocket
+        self.manager = manager
+        self.binary = binary  # MessagePack instead of JSON text
+        self.queue: Deque[Frame] = deque()
+        self.control: Deque[Frame] = deque()  # Pings and history frames
+        self.wakeup = asyncio.Event()
+        self.dropped = 0
+        self.closed = False
+        self.writer_task: Optional[asyncio.Task] = None
+        self.last_activity = time.monotonic()
+        self.ping_sent_at: Optional[float] = None
+        self.user_id: Optional[int] = None  # Set when the handshake carried a valid token
+
+    def start(self):
+        """Start the writer task draining this client's queue"""
+        self.writer_task = asyncio.create_task(self._writer())
+
+    def send(self, frame: Frame) -> bool:
+        """Queue a frame for this client without blocking
+
+        Returns False if the frame could not be queued.
+        """
+        if self.closed:
+            return False
+
+        if len(self.queue) >= self.manager.queue_size:
+            policy = self.manager.policy
+            if policy == DISCONNECT:
+                self.manager.slow_disconnects += 1
+                self.close(code=1008, reason="Client too slow")
+                return False
+
+            if policy == COALESCE:
+                self._coalesce()
+            else:
+                self.queue.popleft()
+                self.dropped += 1
+                self.manager.dropped += 1
+
+        self.queue.append(frame)
+        self.wakeup.set()
+        return True
+
+    def _coalesce(self):
+        """Merge the whole queue into one batch frame, keeping at most the newest
+        `coalesce_max` messages"""
+        merged = Frame.batch(self.queue)
+        self.queue.clear()
+        overflow = len(merged.items) - self.manager.coalesce_max
+        if overflow > 0:
+            merged.items = merged.items[overflow:]
+            self.dropped += overflow
+            self.manager.dropped += overflow
+        self.queue.append(merged)
+        self.manager.coalesced += 1
+
+    def send_control(self, frame: Frame) -> bool:
+        """Queue a ping or history frame
+
+        These go out ahead of chat frames, one per WebSocket frame, and are
+        never shed or merged into a batch, which the client would render
+        as chat lines. Returns False if the frame could not be queued.
+        """
+        if self.closed:
+            return False
+        if len(self.control) >= self.manager.queue_size:
+            self.manager.slow_disconnects += 1
+            self.close(code=1008, reason="Client too slow")
+            return False
+        self.control.append(frame)
+        self.wakeup.set()
+        return True
+
+    def pong(self):
+        """Record that the client is answering; any inbound frame counts as a pong"""
+        self.ping_sent_at = None
+
+    def touch(self):
+        """Record chat or scroll-back activity (pongs alone don't keep a client from going idle)"""
+        self.last_activity = time.monotonic()
+
+    def close(self, code: int = 1000, reason: str = ""):
+        """Stop the writer and close the socket in the background"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self.control.clear()
+        self.manager.discard(self)
+        if self.writer_task and self.writer_task is not asyncio.current_task():
+            self.writer_task.cancel()
+        self.manager.track(asyncio.create_task(self._close_socket(code, reason)))
+
+    async def _close_socket(self, code: int, reason: str):
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    async def _writer(self):
+        """Drain the queue onto the socket, control frames first"""
+        try:
+            while not self.closed:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+
+                while self.control or self.queue:
+                    frame = self.control.popleft() if self.control else self.queue.popleft()
+                    await self._send_frame(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Socket is gone - stop delivering to it
+            self.close()
+
+    async def _send_frame(self, frame: Frame):
+        if self.binary:
+            await self.websocket.send_bytes(frame.binary)
+        else:
+            await self.websocket.send_text(frame.text)
+
+
+class ConnectionManager:
+    """Registry of connected clients with non-blocking broadcast"""
+
+    def __init__(self, queue_size: int = WS_SEND_QUEUE_SIZE, policy: str = WS_SLOW_CONSUMER_POLICY,
+                 coalesce_max: int = WS_COALESCE_MAX_MESSAGES):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.coalesce_max = coalesce_max
+        self.clients: Set[ClientConnection] = set()
+        self.tasks: Set[asyncio.Task] = set()  # Sockets being closed
+        self.dropped = 0
+        self.coalesced = 0
+        self.slow_disconnects = 0
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    def connect(self, websocket: WebSocket, binary: bool = False) -> ClientConnection:
+        """Register an accepted WebSocket and start its writer"""
+        client = ClientConnection(websocket, self, binary=binary)
+        self.clients.add(client)
+        client.start()
+        return client
+
+    def disconnect(self, client: ClientConnection):
+        """Unregister a client and stop its writer"""
+        client.closed = True
+        self.discard(client)
+        if client.writer_task:
+            client.writer_task.cancel()
+
+    def discard(self, client: ClientConnection):
+        self.clients.discard(client)
+
+    def track(self, task: asyncio.Task):
+        """Hold a reference to a background task until it finishes"""
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def broadcast(self, frame: Frame):
+        """Queue a frame for every connected client"""
+        started = time.perf_counter()
+        for client in list(self.clients):
+            client.send(frame)
+        BROADCAST_SECONDS.observe(time.perf_counter() - started)
+
+    def stats(self) -> dict:
+        """Queue depth and drop counters for tuning under load"""
+        depths = [len(client.queue) for client in self.clients]
+        return {
+            "clients": len(depths),
+            "queue_size": self.queue_size,
+            "policy": self.policy,
+            "queued_frames": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "dropped_frames": self.dropped,
+            "coalesced_queues": self.coalesced,
+            "slow_disconnects": self.slow_disconnects,
+        }
+
+
+PING_FRAME = Frame({"type": "ping"})
+
+
+class ConnectionSupervisor:
+    """Pings every client on an interval and reaps the ones that stop answering
+
+    A client is closed when it has not sent anything since a ping that is
+    older than `ping_timeout`, or has been silent for `idle_timeout`. Closed
+    clients leave their manager at once, so MAX_CONNECTIONS only counts
+    live sockets.
+    """
+
+    def __init__(self, clients: Callable[[], Iterable[ClientConnection]],
+                 interval: float = WS_PING_INTERVAL, ping_timeout: float = WS_PING_TIMEOUT,
+                 idle_timeout: float = WS_IDLE_TIMEOUT):
+        self.clients = clients
+        self.interval = interval
+        self.ping_timeout = ping_timeout
+        self.idle_timeout = idle_timeout
+        self.task: Optional[asyncio.Task] = None
+
+        # Stats
+        self.sweeps = 0
+        self.reaped_idle = 0
+        self.reaped_ping = 0
+        self.last_reaped = {"idle": 0, "ping_timeout": 0}
+
+    def start(self):
+        if self.interval > 0:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            reaped = self.sweep()
+            if reaped["idle"] or reaped["ping_timeout"]:
+                logger.info(f"Reaped {reaped['ping_timeout']} unresponsive and {reaped['idle']} idle connections")
+
+    def sweep(self) -> dict:
+        """Reap dead clients and ping the rest; returns this sweep's reap counts"""
+        started = time.perf_counter()
+        now = time.monotonic()
+        reaped = {"idle": 0, "ping_timeout": 0}
+        for client in list(self.clients()):
+            if client.closed:
+                continue
+            if client.ping_sent_at is not None and now - client.ping_sent_at >= self.ping_timeout:
+                client.close(code=1011, reason="Ping timeout")
+                reaped["ping_timeout"] += 1
+            elif self.idle_timeout > 0 and now - client.last_activity >= self.idle_timeout:
+                client.close(code=1001, reason="Idle timeout")
+                reaped["idle"] += 1
+            elif client.ping_sent_at is None:
+                client.ping_sent_at = now
+                client.send_control(PING_FRAME)
+
+        self.sweeps += 1
+        self.reaped_idle += reaped["idle"]
+        self.reaped_ping += reaped["ping_timeout"]
+        self.last_reaped = reaped
+        TASK_SECONDS.labels("supervisor_sweep").observe(time.perf_counter() - started)
+        return reaped
+
+    def stats(self) -> dict:
+        return {
+            "interval": self.interval,
+            "sweeps": self.sweeps,
+            "reaped_idle": self.reaped_idle,
+            "reaped_ping_timeout": self.reaped_ping,
+            "last_sweep": self.last_reaped,
+        }
+
+
+class BroadcastCoalescer:
+    """Gathers a room's broadcasts for a short window, then sends one frame
+
+    Each flush hands the manager a single frame (an array frame if more than
+    one message arrived), so a burst of N messages costs each client one
+    send instead of N. The window adapts to the room's message rate: near
+    `min_window_ms` when quiet and up to `max_window_ms` during a burst.
+    """
+
+    RATE_DECAY = 1.0  # Seconds over which the rate estimate decays
+
+    def __init__(self, manager: ConnectionManager, min_window_ms: float = BROADCAST_WINDOW_MIN_MS,
+                 max_window_ms: float = BROADCAST_WINDOW_MAX_MS, batch_max: int = BROADCAST_BATCH_MAX,
+                 burst_rate: float = BROADCAST_BURST_RATE):
+        self.manager = manager
+        self.min_window = min_window_ms / 1000
+        self.max_window = max_window_ms / 1000
+        self.batch_max = batch_max
+        self.burst_rate = burst_rate
+        self.pending: List[Frame] = []
+        self.rate = 0.0  # Decaying estimate of messages per second
+        self._last_add: Optional[float] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        # Stats
+        self.flushes = 0
+        self.coalesced = 0
+        self.largest_batch = 0
+
+    @property
+    def window(self) -> float:
+        """Current coalescing window in seconds"""
+        load = min(self.rate / self.burst_rate, 1.0) if self.burst_rate > 0 else 1.0
+        return self.min_window + (self.max_window - self.min_window) * load
+
+    def add(self, frame: Frame):
+        """Queue a frame for the next flush"""
+        now = time.monotonic()
+        if self._last_add is not None:
+            self.rate *= math.exp(-(now - self._last_add) / self.RATE_DECAY)
+        self.rate += 1 / self.RATE_DECAY
+        self._last_add = now
+
+        self.pending.append(frame)
+        if len(self.pending) >= self.batch_max:
+            self.flush()
+        elif self._timer is None:
+            window = self.window
+            if window <= 0:
+                self.flush()
+            else:
+                self._timer = asyncio.get_running_loop().call_later(window, self.flush)
+
+    def flush(self):
+        """Send whatever is pending as one frame"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self.pending:
+            return
+
+        pending, self.pending = self.pending, []
+        frame = pending[0] if len(pending) == 1 else Frame.batch(pending)
+        self.manager.broadcast(frame)
+
+        self.flushes += 1
+        self.coalesced += len(pending)
+        self.largest_batch = max(self.largest_batch, len(pending))
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": round(self.window * 1000, 2),
+            "rate": round(self.rate, 2),
+            "flushes": self.flushes,
+            "messages": self.coalesced,
+            "largest_batch": self.largest_batch,
+        }
@@ -1,74 +1,215 @@
 """Database configuration and session management"""
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.exc import DisconnectionError, SQLAlchemyError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from typing import AsyncIterator
+import asyncio
 import logging
-from backend.config import DATABASE_URL
+import time
+from backend.config import (
+    DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_PING_INTERVAL,
+    SQLITE_BUSY_TIMEOUT_MS, SQLITE_MMAP_SIZE
+)
+from backend.metrics import Counter, Gauge, Histogram
 
 logger = logging.getLogger(__name__)
 
-# Create engine with appropriate connection args
-connect_args = {}
-if "sqlite" in DATABASE_URL:
-    connect_args = {"check_same_thread": False}
-elif "postgresql" in DATABASE_URL or "postgres" in DATABASE_URL:
-    # PostgreSQL connection pooling
-    connect_args = {"connect_timeout": 10}
 
-try:
-    engine = create_engine(
-        DATABASE_URL,
-        connect_args=connect_args,
-        pool_pre_ping=True,  # Verify connections before using
-        echo=False  # Set to True for SQL query logging
+def async_database_url(url: str) -> str:
+    """Pick the asyncio driver for DATABASE_URL
+
+    sqlite:// uses aiosqlite and postgresql:// uses asyncpg. URLs that
+    already name a driver are left alone.
+    """
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql:"):
+        url = url.replace("postgresql:", "postgresql+asyncpg:", 1)
+        # asyncpg spells libpq's sslmode as ssl
+        return url.replace("sslmode=", "ssl=")
+    return url
+
+
+ASYNC_DATABASE_URL = async_database_url(DATABASE_URL)
+SQLITE = ASYNC_DATABASE_URL.startswith("sqlite")
+SQLITE_MEMORY = SQLITE and make_url(ASYNC_DATABASE_URL).database in (None, "", ":memory:")
+
+DB_POOL_WAIT_SECONDS = Histogram(
+    "rageroom_db_pool_wait_seconds", "Time to get a connection from the pool (incl. connecting)", ["pool"]
+)
+DB_POOL_CHECKOUTS = Counter("rageroom_db_pool_checkouts_total", "Connections taken from the pool", ["pool"])
+DB_POOL_TIMEOUTS = Counter(
+    "rageroom_db_pool_timeouts_total", "Checkouts that gave up after DB_POOL_TIMEOUT", ["pool"]
+)
+DB_POOL_IN_USE = Gauge("rageroom_db_pool_in_use", "Connections checked out of all pools")
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waited
+
+    The pool's logging name ("main" or "writer") labels the metrics.
+    """
+
+    def _do_get(self):
+        label = self.logging_name or "main"
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            DB_POOL_TIMEOUTS.labels(label).inc()
+            raise
+        finally:
+            DB_POOL_CHECKOUTS.labels(label).inc()
+            DB_POOL_WAIT_SECONDS.labels(label).observe(time.perf_counter() - started)
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    if not SQLITE_MEMORY:
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+
+def _ping_after_idle(engine):
+    """Ping a connection on checkout only if it sat idle past DB_PING_INTERVAL
+
+    Replaces pool_pre_ping, which costs a round trip on every checkout. A
+    failed ping raises DisconnectionError, so the pool drops the connection
+    and retries with a new one.
+    """
+    @event.listens_for(engine.sync_engine, "checkin")
+    def mark_idle(dbapi_connection, connection_record):
+        connection_record.info["idle_since"] = time.monotonic()
+
+    @event.listens_for(engine.sync_engine, "checkout")
+    def ping_if_stale(dbapi_connection, connection_record, connection_proxy):
+        idle_since = connection_record.info.get("idle_since")
+        if idle_since is not None and time.monotonic() - idle_since > DB_PING_INTERVAL:
+            try:
+                engine.dialect.do_ping(dbapi_connection)
+            except Exception as e:
+                raise DisconnectionError(f"Connection failed ping after being idle: {e}")
+
+
+def _create_engine(name: str, **kwargs):
+    return create_async_engine(
+        ASYNC_DATABASE_URL,
+        pool_logging_name=name,
+        echo=False,  # Set to True for SQL query logging
+        **kwargs
     )
+
+
+try:
+    if SQLITE_MEMORY:
+        # Each connection would be its own database, so keep the default single one
+        engine = _create_engine("main", connect_args={"check_same_thread": False})
+        writer_engine = engine
+    elif SQLITE:
+        # Readers share a pool; writes go through one connection so this
+        # process never contends with itself for the database lock
+        sqlite_args = {"connect_args": {"check_same_thread": False}, "poolclass": TimedQueuePool}
+        engine = _create_engine(
+            "main", pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT, **sqlite_args
+        )
+        writer_engine = _create_engine(
+            "writer", pool_size=1, max_overflow=0, pool_timeout=DB_POOL_TIMEOUT, **sqlite_args
+        )
+    else:
+        connect_args = {"timeout": 10} if "asyncpg" in ASYNC_DATABASE_URL else {}
+        engine = _create_engine(
+            "main",
+            connect_args=connect_args,
+            poolclass=TimedQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+        _ping_after_idle(engine)
+        writer_engine = engine
+
+    engines = {"main": engine}
+    if writer_engine is not engine:
+        engines["writer"] = writer_engine
+    if SQLITE:
+        for sqlite_engine in engines.values():
+            event.listen(sqlite_engine.sync_engine, "connect", _sqlite_pragmas)
     logger.info(f"Database engine created for: {DATABASE_URL.split('@')[-1] if '@' in DATABASE_URL else 'local'}")
 except Exception as e:
     logger.error(f"Failed to create database engine: {e}")
     raise
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def pool_stats() -> dict:
+    """Live connection counts per pool, for capacity planning"""
+    stats = {}
+    for name, pool_engine in engines.items():
+        pool = pool_engine.pool
+        if isinstance(pool, QueuePool):
+            stats[name] = {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0),
+            }
+        else:
+            stats[name] = {"pool": type(pool).__name__}
+    return stats
+
+
+def _connections_in_use() -> int:
+    pools = [pool_engine.pool for pool_engine in engines.values()]
+    return sum(pool.checkedout() for pool in pools if isinstance(pool, QueuePool))
+
+
+DB_POOL_IN_USE.set_function(_connections_in_use)
+
+SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+# For the background writers (message writer, rollover); same as SessionLocal except on SQLite
+WriterSessionLocal = (
+    async_sessionmaker(bind=writer_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    if writer_engine is not engine else SessionLocal
+)
 Base = declarative_base()
 
 
-def get_db():
+async def get_db() -> AsyncIterator[AsyncSession]:
     """Dependency for getting database session"""
-    db = SessionLocal()
-    try:
-        yield db
-    except SQLAlchemyError as e:
-        logger.error(f"Database session error: {e}")
-        db.rollback()
-        raise
-    finally:
-        db.close()
+    async with SessionLocal() as db:
+        try:
+            yield db
+        except SQLAlchemyError as e:
+            logger.error(f"Database session error: {e}")
+            await db.rollback()
+            raise
+
 
+async def init_db():
+    """Create or migrate the database schema (see backend/migrations.py)"""
+    from backend import models  # noqa: F401 - registers the tables on Base
+    from backend.migrations import migrate
 
-def init_db():
-    """Initialize database tables"""
-    from backend.models import Message, User  # Import here to avoid circular imports
-    from sqlalchemy import inspect, text
-    
     try:
-        Base.metadata.create_all(bind=engine)
-        logger.info("Database tables created/verified successfully")
-        
-        # Check if user_id column exists in messages table, add it if missing
-        # This handles databases created before user_id was added
-        try:
-            inspector = inspect(engine)
-            if 'messages' in inspector.get_table_names():
-                columns = [col['name'] for col in inspector.get_columns('messages')]
-                if 'user_id' not in columns:
-                    logger.info("Adding user_id column to messages table...")
-                    with engine.begin() as conn:  # begin() auto-commits
-                        conn.execute(text("ALTER TABLE messages ADD COLUMN user_id INTEGER"))
-                    logger.info("user_id column added successfully")
-        except Exception as migration_error:
-            # If migration fails, log but don't crash - column might already exist
-            logger.warning(f"Could not add user_id column (may already exist): {migration_error}")
+        # Several workers may race to migrate a fresh database; the loser's
+        # retry finds the work already done
+        for attempt in range(3):
+            try:
+                async with engine.begin() as conn:  # begin() auto-commits
+                    version = await conn.run_sync(migrate)
+                break
+            except SQLAlchemyError:
+                if attempt == 2:
+                    raise
+                await asyncio.sleep(0.5)
+        logger.info(f"Database schema at version {version}")
     except Exception as e:
-        logger.error(f"Failed to create database tables: {e}")
+        logger.error(f"Failed to create or migrate database tables: {e}")
         raise
-
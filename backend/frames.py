@@ -0,0 +1,126 @@
+"""Frame encoding: serialize each outbound message once, reuse it everywhere"""
+from typing import List, Optional, Sequence
+import json
+import time
+
+# Fast JSON and MessagePack are optional
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Subprotocols a client can ask for in Sec-WebSocket-Protocol
+JSON_SUBPROTOCOL = "rageroom.json"
+MSGPACK_SUBPROTOCOL = "rageroom.msgpack"
+# Browsers can't set headers on a WebSocket, so a client may send its JWT
+# as "rageroom.bearer.<token>" in the same list; it is never accepted back
+BEARER_SUBPROTOCOL_PREFIX = "rageroom.bearer."
+
+
+def dumps(payload) -> str:
+    """Encode a payload as JSON text, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(payload).decode("utf-8")
+    return json.dumps(payload)
+
+
+def negotiate_subprotocol(requested: Sequence[str]) -> Optional[str]:
+    """Pick the subprotocol to accept from the client's list"""
+    if MSGPACK_SUBPROTOCOL in requested and msgpack is not None:
+        return MSGPACK_SUBPROTOCOL
+    if JSON_SUBPROTOCOL in requested:
+        return JSON_SUBPROTOCOL
+    return None
+
+
+def loads(message: dict):
+    """Decode an incoming websocket.receive message (JSON text or MessagePack)
+
+    Raises ValueError for payloads that cannot be decoded.
+    """
+    text = message.get("text")
+    if text is not None:
+        return orjson.loads(text) if orjson is not None else json.loads(text)
+
+    data = message.get("bytes") or b""
+    if msgpack is not None:
+        try:
+            return msgpack.unpackb(data)
+        except Exception as e:
+            raise ValueError(f"Invalid MessagePack frame: {e}")
+    return json.loads(data)
+
+
+class Frame:
+    """An outbound payload, encoded at most once per wire format
+
+    The text and binary encodings are computed on first use and then shared
+    by every recipient and every later replay. A frame built with `items`
+    is a batch and encodes as an array of those frames.
+    """
+    __slots__ = ("payload", "items", "_text", "_binary")
+
+    def __init__(self, payload=None, text: Optional[str] = None, items: Optional[List["Frame"]] = None):
+        self.payload = payload
+        self.items = items
+        self._text = text
+        self._binary: Optional[bytes] = None
+
+    @classmethod
+    def batch(cls, frames: Sequence["Frame"]) -> "Frame":
+        """Merge frames into one array frame, flattening nested batches"""
+        items = []
+        for frame in frames:
+            if frame.items is not None:
+                items.extend(frame.items)
+            else:
+                items.append(frame)
+        return cls(items=items)
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            if self.items is not None:
+                self._text = "[" + ", ".join(item.text for item in self.items) + "]"
+            else:
+                self._text = dumps(self.payload)
+        return self._text
+
+    @property
+    def binary(self) -> bytes:
+        if self._binary is None:
+            if msgpack is None:
+                raise RuntimeError("msgpack is not installed")
+            if self.items is not None:
+                header = msgpack.Packer().pack_array_header(len(self.items))
+                self._binary = header + b"".join(item.binary for item in self.items)
+            else:
+                self._binary = msgpack.packb(self.payload)
+        return self._binary
+
+
+# System notices reuse one frame per text for up to a second
+_system_frames = {}
+
+
+def system_frame(text: str) -> Frame:
+    """Frame for a notice from "System", rebuilt at most once a second per text"""
+    now = int(time.time())
+    cached = _system_frames.get(text)
+    if cached is not None and cached[0] == now:
+        return cached[1]
+
+    frame = Frame({
+        "user": "System",
+        "text": text,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now))
+    })
+    if len(_system_frames) > 100:
+        _system_frames.clear()
+    _system_frames[text] = (now, frame)
+    return frame
@@ -0,0 +1,122 @@
+"""Readiness check run in the background, so health probes never touch the database"""
+from typing import Dict, Optional
+import asyncio
+import logging
+import time
+from sqlalchemy import text
+from backend.config import READINESS_INTERVAL, READINESS_TIMEOUT, READINESS_MAX_AGE
+from backend.database import SessionLocal
+from backend.metrics import Gauge, TASK_SECONDS
+
+logger = logging.getLogger(__name__)
+
+READY = Gauge("rageroom_ready", "1 while this worker's last readiness check passed")
+
+
+class ReadinessProbe:
+    """Pings the database and checks the background tasks every `interval`
+
+    /readyz returns the cached result, so a probe costs the same however
+    often the load balancer polls. A result older than `max_age` (the loop
+    itself has stalled) is reported as not ready, and so is a worker that
+    is shutting down.
+    """
+
+    def __init__(self, interval: float = READINESS_INTERVAL, timeout: float = READINESS_TIMEOUT,
+                 max_age: float = READINESS_MAX_AGE):
+        self.interval = interval
+        self.timeout = timeout
+        self.max_age = max_age
+        self.tasks: Dict[str, object] = {}  # name -> object with a .task attribute
+        self.task: Optional[asyncio.Task] = None
+        self.checks: dict = {}
+        self.checked_at: Optional[float] = None
+        self.draining = False
+
+        # Stats
+        self.runs = 0
+        self.failures = 0
+        self.last_check_ms = 0.0
+
+    def watch(self, name: str, owner):
+        """Report not ready if owner.task has finished (a None task is disabled)"""
+        self.tasks[name] = owner
+
+    async def check(self):
+        started = time.perf_counter()
+        checks = {"database": await self._ping()}
+        for name, owner in self.tasks.items():
+            task = owner.task
+            checks[name] = "ok" if task is None or not task.done() else "stopped"
+        self.checks = checks
+        self.checked_at = time.monotonic()
+        self.runs += 1
+        if not self.ready:
+            self.failures += 1
+            logger.warning("Readiness check failed", extra={"checks": checks})
+        self.last_check_ms = (time.perf_counter() - started) * 1000
+        TASK_SECONDS.labels("readiness").observe(time.perf_counter() - started)
+
+    async def _ping(self) -> str:
+        try:
+            async with SessionLocal() as db:
+                await asyncio.wait_for(db.execute(text("SELECT 1")), self.timeout)
+            return "ok"
+        except asyncio.TimeoutError:
+            return "timeout"
+        except Exception as e:
+            return f"error: {type(e).__name__}"
+
+    @property
+    def age(self) -> Optional[float]:
+        return time.monotonic() - self.checked_at if self.checked_at is not None else None
+
+    @property
+    def ready(self) -> bool:
+        age = self.age
+        return (
+            not self.draining
+            and age is not None and age <= self.max_age
+            and all(result == "ok" for result in self.checks.values())
+        )
+
+    async def start(self):
+        """Run the first check now, then keep refreshing in the background"""
+        self.draining = False
+        await self.check()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self.draining = True
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.check()
+            except Exception:
+                logger.exception("Readiness check crashed")
+
+    def stats(self) -> dict:
+        age = self.age
+        return {
+            "ready": self.ready,
+            "draining": self.draining,
+            "checks": self.checks,
+            "checked_seconds_ago": round(age, 1) if age is not None else None,
+            "runs": self.runs,
+            "failures": self.failures,
+            "last_check_ms": round(self.last_check_ms, 2),
+        }
+
+
+# Readiness of this process
+readiness = ReadinessProbe()
+READY.set_function(lambda: 1 if readiness.ready else 0)
@@ -0,0 +1,181 @@
+"""In-memory ring buffer of today's messages"""
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple
+from sqlalchemy import select, func
+from backend.config import HISTORY_BUFFER_SIZE, DEFAULT_ROOM
+from backend.frames import Frame
+from backend.models import Message
+from backend.utils import today
+
+
+class HistoryRecord:
+    """Compact copy of a stored message with its encoded frame"""
+    __slots__ = ("id", "user", "text", "timestamp", "date_created", "user_id", "room", "origin", "frame")
+
+    def __init__(self, id: int, user: str, text: str, timestamp: datetime,
+                 date_created: str, user_id: Optional[int] = None, room: str = DEFAULT_ROOM,
+                 origin: Optional[str] = None):
+        self.id = id
+        self.user = user
+        self.text = text
+        self.timestamp = timestamp
+        self.date_created = date_created
+        self.user_id = user_id
+        self.room = room
+        self.origin = origin  # Broker origin of the worker saving it; None once loaded from the database
+        self.frame = Frame(self.to_dict())
+
+    @classmethod
+    def from_message(cls, message: Message) -> "HistoryRecord":
+        return cls(
+            id=message.id,
+            user=message.user,
+            text=message.text,
+            timestamp=message.timestamp,
+            date_created=message.date_created,
+            user_id=message.user_id,
+            room=message.room
+        )
+
+    @property
+    def json(self) -> str:
+        return self.frame.text
+
+    def to_dict(self) -> dict:
+        """Same shape as Message.to_dict"""
+        return {
+            "id": self.id,
+            "user": self.user,
+            "text": self.text,
+            "timestamp": self.timestamp.isoformat()
+        }
+
+
+class MessageHistory:
+    """A room's most recent messages today, shared by every read path
+
+    Holds at most `maxlen` records; `count` keeps tracking the full number of
+    messages for today so callers know when older pages live only in the DB.
+    """
+
+    def __init__(self, room: str = DEFAULT_ROOM, maxlen: int = HISTORY_BUFFER_SIZE):
+        self.room = room
+        self.maxlen = maxlen
+        self.date = today()
+        self.records: Deque[HistoryRecord] = deque()
+        self.by_id: Dict[int, HistoryRecord] = {}
+        self.count = 0
+        self.version = 0  # Bumped on every change, for caching replay frames
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    async def load(self, db):
+        """Fill the buffer from the database (at startup, or when a room is reopened)"""
+        date = today()
+        todays = (Message.date_created == date, Message.room == self.room)
+        result = await db.execute(
+            select(Message).where(*todays).order_by(Message.id.desc()).limit(self.maxlen)
+        )
+        messages = result.scalars().all()
+        count = await db.scalar(select(func.count(Message.id)).where(*todays))
+
+        # Keep messages that were broadcast while the query ran
+        newest = messages[0].id if messages else 0
+        arrived = [record for record in self.records if record.id > newest]
+
+        self.clear(date)
+        for message in reversed(messages):
+            self._push(HistoryRecord.from_message(message))
+        for record in arrived:
+            self._push(record)
+        self.count = count + len(arrived)
+
+    def append(self, record: HistoryRecord):
+        """Add a newly stored message"""
+        if record.date_created != self.date:
+            if record.date_created < self.date:
+                # Sent just before a rollover; that day is already gone
+                return
+            self.clear(record.date_created)
+        self._push(record)
+        self.count += 1
+
+    def _push(self, record: HistoryRecord):
+        self.version += 1
+        if len(self.records) >= self.maxlen:
+            oldest = self.records.popleft()
+            self.by_id.pop(oldest.id, None)
+        self.records.append(record)
+        self.by_id[record.id] = record
+
+    def evict(self, message_id: int) -> bool:
+        """Drop a deleted message; returns True if it was buffered"""
+        record = self.by_id.pop(message_id, None)
+        if record is None:
+            return False
+        self.records.remove(record)
+        self.count = max(self.count - 1, 0)
+        self.version += 1
+        return True
+
+    def clear(self, date: Optional[str] = None):
+        """Empty the buffer, optionally starting a new day"""
+        self.date = date or today()
+        self.records.clear()
+        self.by_id.clear()
+        self.count = 0
+        self.version += 1
+
+    @property
+    def truncated(self) -> bool:
+        """True when some of today's messages are only in the database"""
+        return self.count > len(self.records)
+
+    def page(self, before: Optional[int] = None, limit: int = 50) -> Tuple[List[HistoryRecord], bool]:
+        """Up to `limit` records older than `before` (or the newest), oldest first
+
+        Returns the records and whether older messages exist.
+        """
+        if before is None:
+            end = len(self.records)
+        else:
+            end = 0
+            for index in range(len(self.records) - 1, -1, -1):
+                if self.records[index].id < before:
+                    end = index + 1
+                    break
+
+        start = max(end - limit, 0)
+        records = [self.records[index] for index in range(start, end)]
+        has_more = start > 0 or self.truncated
+        return records, has_more
+
+    def since(self, message_id: int, limit: int) -> Optional[List[HistoryRecord]]:
+        """Records newer than `message_id`, oldest first
+
+        Returns None when the buffer cannot answer exactly (older messages
+        were dropped from it, more than `limit` are newer, or the id is newer
+        than anything here, as after a restart or a clear), in which case
+        the caller should send a full replay instead.
+        """
+        if not self.records or message_id > self.records[-1].id:
+            return None
+        if self.truncated and message_id < self.records[0].id:
+            return None
+
+        newer = []
+        for index in range(len(self.records) - 1, -1, -1):
+            record = self.records[index]
+            if record.id <= message_id:
+                break
+            if len(newer) >= limit:
+                return None
+            newer.append(record)
+        newer.reverse()
+        return newer
+
+    def oldest_id(self) -> Optional[int]:
+        return self.records[0].id if self.records else None
+
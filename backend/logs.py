@@ -0,0 +1,210 @@
+"""Non-blocking structured logging with sampling, rate caps and correlation ids
+
+Records are put on a bounded queue by the thread that logs them and written
+by a background QueueListener thread, so a log call on the event loop costs
+a dict copy, never a write to stderr. Before a record is queued, the
+logger's policy from LOG_SAMPLING / LOG_RATE_CAPS may drop it; WARNING and
+above are never sampled, ERROR and above are never capped. The request or
+connection id of the current task is attached to every record.
+"""
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import re
+import time
+import uuid
+from backend.config import LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_SAMPLING, LOG_RATE_CAPS
+from backend.metrics import Counter
+
+LOG_DROPPED = Counter("rageroom_log_records_dropped_total", "Log records dropped before output", ["reason"])
+
+# Set per HTTP request by RequestIdMiddleware and per WebSocket in websocket_endpoint
+request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+connection_id: ContextVar[Optional[str]] = ContextVar("connection_id", default=None)
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Attributes every LogRecord has; anything else came from `extra=`
+# (uvicorn adds an ANSI-coloured copy of its messages, which is skipped too)
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {
+    "message", "asctime", "request_id", "connection_id", "color_message"
+}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with `extra=` fields as top-level keys"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key in ("request_id", "connection_id"):
+            value = getattr(record, key, None)
+            if value:
+                entry[key] = value
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class LogPolicyFilter(logging.Filter):
+    """Sampling and per-second caps per logger, plus the correlation ids"""
+
+    def __init__(self, sampling: Dict[str, float], rate_caps: Dict[str, float]):
+        super().__init__()
+        self.sampling = sampling
+        self.rate_caps = rate_caps
+        self.buckets: Dict[str, list] = {}  # policy name -> [tokens, updated]
+        self._policies: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+
+    def _policy(self, name: str) -> Tuple[Optional[str], Optional[str]]:
+        """Most specific sampling and cap entries for a logger name (cached)"""
+        policy = self._policies.get(name)
+        if policy is None:
+            policy = self._policies[name] = (_match(name, self.sampling), _match(name, self.rate_caps))
+        return policy
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        sample_key, cap_key = self._policy(record.name)
+        if sample_key is not None and record.levelno < logging.WARNING:
+            if random.random() >= self.sampling[sample_key]:
+                LOG_DROPPED.labels("sampled").inc()
+                return False
+        if cap_key is not None and record.levelno < logging.ERROR and not self._take(cap_key):
+            LOG_DROPPED.labels("rate_cap").inc()
+            return False
+        record.request_id = request_id.get()
+        record.connection_id = connection_id.get()
+        return True
+
+    def _take(self, key: str) -> bool:
+        # Token bucket holding one second's worth of records
+        rate = self.rate_caps[key]
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [rate, now]
+        else:
+            bucket[0] = min(rate, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+
+def _match(name: str, table: Dict[str, float]) -> Optional[str]:
+    while name:
+        if name in table:
+            return name
+        name = name.rpartition(".")[0]
+    return None
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of blocking"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Render the message and traceback now (the arguments may change
+        # before the listener gets to them) but keep the record's fields
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.labels("queue_full").inc()
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    """Route the root and uvicorn loggers through the queue (once per process)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler()
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(LogPolicyFilter(LOG_SAMPLING, LOG_RATE_CAPS))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+    # uvicorn installs its own synchronous handlers on these two
+    for name in ("uvicorn", "uvicorn.access"):
+        logging.getLogger(name).handlers = [handler]
+
+    _listener = QueueListener(handler.queue, output)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Write out whatever is still queued and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+_REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+class RequestIdMiddleware:
+    """ASGI middleware giving each HTTP request an id for its log records
+
+    A well-formed X-Request-ID from the client or proxy is reused, otherwise
+    a new one is made; either way it is echoed in the response headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                incoming = value.decode("latin-1")
+                break
+        rid = incoming if incoming and _REQUEST_ID_PATTERN.match(incoming) else uuid.uuid4().hex[:16]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", rid.encode("latin-1"))]
+            await send(message)
+
+        token = request_id.set(rid)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id.reset(token)
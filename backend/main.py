@@ -9,21 +9,27 @@ from contextlib import asynccontextmanager
 from datetime import datetime
 import asyncio
 import logging
+from sqlalchemy import select
 
 from backend.config import ALLOWED_ORIGINS, STATIC_DIR, ADMIN_EMAIL, ADMIN_PASSWORD
 from backend.database import init_db, SessionLocal
 from backend.routes import router
 from backend.auth_routes import router as auth_router
 from backend.admin_routes import router as admin_router
-from backend.websocket import websocket_endpoint, midnight_clear_task, keep_alive_task
+from backend.websocket import websocket_endpoint, keep_alive_task, deliver_event
 from backend.models import User
-from backend.auth import get_password_hash
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from backend.auth import hash_password, check_password, needs_rehash
+from backend.rooms import rooms, supervisor
+from backend.rollover import rollover
+from backend.totals import totals
+from backend.health import readiness
+from backend.persistence import message_writer
+from backend.broker import broker
+from backend.metrics import MetricsMiddleware
+from backend.logs import setup_logging, RequestIdMiddleware
+
+# Configure logging (JSON lines written off the event loop)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
@@ -31,58 +37,87 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     """Application lifespan manager - handles startup and shutdown"""
     # Startup
-    print("=" * 50)
-    print("SERVER STARTING UP")
-    print(f"Current date: {datetime.now()}")
+    logger.info(f"Server starting up (current date: {datetime.now()})")
 
     # Initialize database
-    init_db()
+    await init_db()
 
     # Create admin user if it doesn't exist and password is set
     if ADMIN_PASSWORD:
-        db = SessionLocal()
-        try:
-            admin = db.query(User).filter(User.email == ADMIN_EMAIL).first()
-            if not admin:
-                admin = User(
-                    email=ADMIN_EMAIL,
-                    username="admin",
-                    hashed_password=get_password_hash(ADMIN_PASSWORD),
-                    is_admin=True,
-                    is_active=True
-                )
-                db.add(admin)
-                db.commit()
-                logger.info(f"✅ Admin user created: {ADMIN_EMAIL}")
-            else:
-                # Update password if admin exists (in case password changed)
-                admin.hashed_password = get_password_hash(ADMIN_PASSWORD)
-                admin.is_admin = True
-                admin.is_active = True
-                db.commit()
-                logger.info(f"ℹ️  Admin user already exists: {ADMIN_EMAIL} (password updated)")
-        except Exception as e:
-            logger.error(f"⚠️  Error creating/updating admin user: {e}")
-            db.rollback()
-        finally:
-            db.close()
+        async with SessionLocal() as db:
+            try:
+                admin = await db.scalar(select(User).where(User.email == ADMIN_EMAIL))
+                if not admin:
+                    admin = User(
+                        email=ADMIN_EMAIL,
+                        username="admin",
+                        hashed_password=await hash_password(ADMIN_PASSWORD),
+                        is_admin=True,
+                        is_active=True
+                    )
+                    db.add(admin)
+                    await db.commit()
+                    logger.info(f"✅ Admin user created: {ADMIN_EMAIL}")
+                else:
+                    # Only re-hash if the password (or the bcrypt cost) changed
+                    password_changed = (
+                        needs_rehash(admin.hashed_password)
+                        or not await check_password(ADMIN_PASSWORD, admin.hashed_password)
+                    )
+                    if password_changed:
+                        admin.hashed_password = await hash_password(ADMIN_PASSWORD)
+                    admin.is_admin = True
+                    admin.is_active = True
+                    await db.commit()
+                    status = "password updated" if password_changed else "password unchanged"
+                    logger.info(f"ℹ️  Admin user already exists: {ADMIN_EMAIL} ({status})")
+            except Exception as e:
+                logger.error(f"⚠️  Error creating/updating admin user: {e}")
+                await db.rollback()
     else:
         logger.warning("⚠️  ADMIN_PASSWORD not set - admin user not created")
 
+    # Load today's messages into the in-memory history
+    async with SessionLocal() as db:
+        await rooms.load(db)
+        for room in rooms:
+            history = room.history
+            logger.info(
+                f"Loaded {len(history)} of {history.count} messages for {history.date} into room {room.name}",
+                extra={"room": room.name, "loaded": len(history), "total": history.count}
+            )
+        await message_writer.start(db)
+
+    # Count users and messages once; broker events keep the totals current
+    await totals.reconcile()
+
+    # Connect to the other workers
+    await broker.start(deliver_event, message_writer.allocate_id)
+    logger.info("Broker started", extra={"broker": broker.stats()})
+
     # Start background tasks
-    print("Starting background tasks...")
-    asyncio.create_task(midnight_clear_task())
     asyncio.create_task(keep_alive_task())
+    supervisor.start()
+    rollover.start()
+    totals.start()
+    for name, owner in (("writer", message_writer), ("rollover", rollover),
+                        ("stats", totals), ("supervisor", supervisor)):
+        readiness.watch(name, owner)
+    await readiness.start()
 
-    print("Server startup complete!")
-    print("=" * 50)
+    logger.info("Server startup complete")
 
     yield  # Server runs here
 
     # Shutdown
-    print("=" * 50)
-    print("SERVER SHUTTING DOWN")
-    print("=" * 50)
+    logger.info("Server shutting down")
+    await readiness.stop()
+    await rollover.stop()
+    await supervisor.stop()
+    await broker.stop()
+    await message_writer.stop()
+    await totals.stop()
+    logger.info(f"Flushed pending messages ({message_writer.flushed} written this run)")
 
 
 # Initialize FastAPI app with lifespan
@@ -111,6 +146,12 @@ else:
         expose_headers=["*"],
     )
 
+# Per-route request latency for /metrics
+app.add_middleware(MetricsMiddleware)
+
+# X-Request-ID on every response and on the request's log records
+app.add_middleware(RequestIdMiddleware)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
@@ -122,6 +163,12 @@ app.include_router(admin_router)
 
 @app.websocket("/ws")
 async def websocket_route(websocket: WebSocket):
-    """WebSocket endpoint for real-time chat"""
+    """WebSocket endpoint for real-time chat in the default room"""
     await websocket_endpoint(websocket)
 
+
+@app.websocket("/ws/{room}")
+async def websocket_room_route(websocket: WebSocket, room: str):
+    """WebSocket endpoint for real-time chat in a named room"""
+    await websocket_endpoint(websocket, room)
+
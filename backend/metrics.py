@@ -0,0 +1,239 @@
+"""In-process metrics exposed on /metrics in Prometheus text format
+
+Counters, gauges and histograms are plain Python objects updated in place;
+there is no background thread and no lock (everything runs on the event
+loop). With several workers each process reports its own numbers;
+rageroom_process_id says which worker answered the scrape.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import os
+import time
+
+# Seconds; covers sub-millisecond fan-out up to slow DB commits
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: List["Metric"] = []
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base metric: a family of children keyed by label values"""
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        _registry.append(self)
+
+    def labels(self, *values):
+        """Child metric for these label values (created on first use)"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        """(suffix, label values, extra label, value) rows"""
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} {_format_value(value)}")
+        return lines
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for values, child in self._children.items():
+            yield "", values, "", child.value
+
+
+class Gauge(Metric):
+    """A value that goes up and down, or is read from `function` at scrape time"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], float]] = None):
+        super().__init__(name, help, labelnames)
+        self.function = function
+
+    def set_function(self, function: Callable[[], float]):
+        self.function = function
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def _samples(self):
+        if self.function is not None:
+            yield "", (), "", self.function()
+            return
+        for values, child in self._children.items():
+            yield "", values, "", child.value
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(Metric):
+    """Distribution of observations in fixed buckets"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    @contextmanager
+    def time(self, *labels):
+        """Observe the duration of a with-block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.labels(*labels).observe(time.perf_counter() - started)
+
+    def _samples(self):
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                yield "_bucket", values, f'le="{_format_value(bound)}"', cumulative
+            yield "_sum", values, "", child.sum
+            yield "_count", values, "", child.count
+
+
+def render() -> str:
+    """All registered metrics in Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Chat
+CONNECTED_CLIENTS = Gauge("rageroom_connected_clients", "WebSocket clients connected to this worker")
+ROOMS = Gauge("rageroom_rooms", "Rooms open on this worker")
+MESSAGES_RECEIVED = Counter("rageroom_messages_received_total", "Chat messages received from clients")
+MESSAGES_BROADCAST = Counter("rageroom_messages_broadcast_total", "Chat messages broadcast to a room")
+MESSAGES_REJECTED = Counter(
+    "rageroom_messages_rejected_total", "Chat messages rejected before broadcast", ["reason"]
+)
+BROADCAST_SECONDS = Histogram("rageroom_broadcast_fanout_seconds", "Time to queue one frame for every client in a room")
+HISTORY_REPLAY_SECONDS = Histogram(
+    "rageroom_history_replay_seconds", "Time to build the history frame for a joining client", ["kind"]
+)
+DB_COMMIT_SECONDS = Histogram("rageroom_db_commit_seconds", "Time to write and commit a batch of messages")
+PERSIST_PENDING = Gauge("rageroom_persist_pending", "Messages waiting to be written")
+PERSIST_DROPPED = Counter("rageroom_persist_dropped_total", "Messages that were never written", ["reason"])
+
+# HTTP
+HTTP_REQUESTS = Counter("rageroom_http_requests_total", "HTTP requests", ["method", "route", "status"])
+HTTP_SECONDS = Histogram("rageroom_http_request_duration_seconds", "HTTP request latency", ["method", "route"])
+
+# Background tasks
+TASK_SECONDS = Histogram("rageroom_background_task_seconds", "Duration of one background task run", ["task"])
+
+PROCESS_START = Gauge("rageroom_process_start_time_seconds", "Start time of this worker since the epoch")
+PROCESS_START.set(time.time())
+PROCESS_ID = Gauge("rageroom_process_id", "Process id of the worker that answered the scrape", function=os.getpid)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by its route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            HTTP_SECONDS.labels(method, route).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(method, route, status["code"]).inc()
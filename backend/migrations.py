@@ -0,0 +1,147 @@
+"""Versioned schema migrations, recorded in the schema_version table
+
+Boot reads the highest applied version and stops there when it is current,
+so an up-to-date database costs one query and no introspection (the
+schema_version table is only created when that query fails). Otherwise
+create_all adds any new tables and the pending migrations run in order in
+one transaction. A database with no tables yet gets the current schema from
+create_all and is stamped with the latest version without running anything.
+
+Append new migrations to MIGRATIONS; never edit or reorder applied ones.
+"""
+from datetime import datetime, timezone
+from typing import Callable, List, NamedTuple
+import logging
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, inspect, select, text
+from sqlalchemy.exc import DBAPIError
+from backend.database import Base
+
+logger = logging.getLogger(__name__)
+
+schema_version = Table(
+    "schema_version", MetaData(),
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("description", String(200), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable  # (sync connection) -> None
+
+
+def _baseline(connection):
+    # Columns added before migrations existed; older databases may lack them
+    columns = [col["name"] for col in inspect(connection).get_columns("messages")]
+    if "user_id" not in columns:
+        logger.info("Adding user_id column to messages table")
+        connection.execute(text("ALTER TABLE messages ADD COLUMN user_id INTEGER"))
+    if "room" not in columns:
+        logger.info("Adding room column to messages table")
+        connection.execute(text("ALTER TABLE messages ADD COLUMN room VARCHAR(50) NOT NULL DEFAULT 'main'"))
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_room ON messages (room)"))
+
+
+def _daily_history_indexes(connection):
+    # Today's messages by time (midnight delete, counts, admin listing), and
+    # one room's messages for a day by id (history load and scroll-back)
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_messages_date_created_timestamp ON messages (date_created, timestamp)"
+    ))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_messages_room_date_created_id ON messages (room, date_created, id)"
+    ))
+
+
+def _admin_listing_indexes(connection):
+    # Keyset pages of the admin message list, newest first, unfiltered or
+    # filtered by nickname or account
+    for name, columns in (
+        ("ix_messages_timestamp_id", "timestamp, id"),
+        ("ix_messages_user_timestamp", '"user", timestamp'),  # user is reserved in PostgreSQL
+        ("ix_messages_user_id_timestamp", "user_id, timestamp"),
+    ):
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON messages ({columns})"))
+
+
+def _daily_stats_table(connection):
+    from backend.models import DailyStats
+    DailyStats.__table__.create(connection, checkfirst=True)
+
+
+def _message_sequence(connection):
+    from backend.models import MessageSequence
+    MessageSequence.__table__.create(connection, checkfirst=True)
+    _seed_message_sequence(connection)
+
+
+def _seed_message_sequence(connection):
+    # Start from the highest id still in the table (ids purged earlier are unknown)
+    from backend.models import Message, MessageSequence
+    if connection.scalar(select(MessageSequence.id)) is None:
+        last_id = connection.scalar(select(func.max(Message.id))) or 0
+        connection.execute(MessageSequence.__table__.insert().values(id=1, last_id=last_id))
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline: messages.user_id and messages.room", _baseline),
+    Migration(2, "composite indexes for the daily history queries", _daily_history_indexes),
+    Migration(3, "indexes for the admin message listing filters", _admin_listing_indexes),
+    Migration(4, "daily_stats snapshot table", _daily_stats_table),
+    Migration(5, "message_sequence high-water mark for message ids", _message_sequence),
+]
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(connection) -> int:
+    """Highest applied version (0 for a database that has none)"""
+    return connection.scalar(select(func.max(schema_version.c.version))) or 0
+
+
+def _record(connection, migration: Migration):
+    connection.execute(schema_version.insert().values(
+        version=migration.version,
+        description=migration.description,
+        applied_at=datetime.now(timezone.utc).replace(tzinfo=None),
+    ))
+
+
+def migrate(connection) -> int:
+    """Bring the schema up to LATEST_VERSION; returns the version it ends at
+
+    Runs inside one transaction (engine.begin() + run_sync).
+    """
+    try:
+        # A savepoint, so a missing table doesn't abort the transaction
+        with connection.begin_nested():
+            version = current_version(connection)
+    except DBAPIError:
+        schema_version.create(connection)
+        version = 0
+    if version >= LATEST_VERSION:
+        return version
+
+    if connection.dialect.name == "postgresql":
+        # Workers booting together: the others wait here, then find it done
+        connection.execute(text("SELECT pg_advisory_xact_lock(hashtext('rage_room_migrations'))"))
+        version = current_version(connection)
+        if version >= LATEST_VERSION:
+            return version
+
+    fresh = "messages" not in inspect(connection).get_table_names()
+    Base.metadata.create_all(connection)
+    if fresh:
+        _seed_message_sequence(connection)
+        for migration in MIGRATIONS:
+            _record(connection, migration)
+        logger.info(f"Created schema at version {LATEST_VERSION}")
+        return LATEST_VERSION
+
+    for migration in MIGRATIONS:
+        if migration.version > version:
+            logger.info(f"Applying migration {migration.version}: {migration.description}")
+            migration.apply(connection)
+            _record(connection, migration)
+    return LATEST_VERSION
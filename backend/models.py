@@ -1,7 +1,8 @@
 """Database models"""
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey, Index
 from datetime import datetime, timezone
 from backend.database import Base
+from backend.config import DEFAULT_ROOM
 
 
 class User(Base):
@@ -37,12 +38,42 @@ class Message(Base):
     timestamp = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
     date_created = Column(String(10), nullable=False)  # YYYY-MM-DD for daily clearing
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)  # Optional link to registered user
+    room = Column(String(50), nullable=False, default=DEFAULT_ROOM, server_default=DEFAULT_ROOM, index=True)
+
+    # Added by migrations 2 and 3 on existing databases
+    __table_args__ = (
+        Index("ix_messages_date_created_timestamp", "date_created", "timestamp"),
+        Index("ix_messages_room_date_created_id", "room", "date_created", "id"),
+        Index("ix_messages_timestamp_id", "timestamp", "id"),
+        Index("ix_messages_user_timestamp", "user", "timestamp"),
+        Index("ix_messages_user_id_timestamp", "user_id", "timestamp"),
+    )
 
     def to_dict(self):
         """Convert to dictionary for JSON serialization"""
         return {
+            "id": self.id,
             "user": self.user,
             "text": self.text,
             "timestamp": self.timestamp.isoformat()
         }
 
+
+class DailyStats(Base):
+    """Snapshot of the running totals, one row per day"""
+    __tablename__ = "daily_stats"
+
+    date = Column(String(10), primary_key=True)  # YYYY-MM-DD
+    users = Column(Integer, nullable=False, default=0)
+    messages_total = Column(Integer, nullable=False, default=0)
+    messages_today = Column(Integer, nullable=False, default=0)
+    peak_clients = Column(Integer, nullable=False, default=0)  # On any one worker
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), nullable=False)
+
+
+class MessageSequence(Base):
+    """Highest message id ever written, so deletes never let an id be reused"""
+    __tablename__ = "message_sequence"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)  # Always 1
+    last_id = Column(Integer, nullable=False, default=0)
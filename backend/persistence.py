@@ -0,0 +1,303 @@
+"""Write-behind message persistence with batched group commits"""
+from typing import Dict, List, Optional, Set
+import asyncio
+import logging
+import time
+from sqlalchemy import select, delete, func, update
+from sqlalchemy.exc import DataError, IntegrityError
+from backend.config import PERSIST_BATCH_SIZE, PERSIST_FLUSH_INTERVAL, PERSIST_MAX_RETRIES, PERSIST_MAX_PENDING
+from backend.database import WriterSessionLocal
+from backend.history import HistoryRecord
+from backend.models import Message, MessageSequence
+from backend.metrics import DB_COMMIT_SECONDS, PERSIST_DROPPED, PERSIST_PENDING, TASK_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriter:
+    """Queue of messages waiting to be written, flushed in batches
+
+    Messages are broadcast as soon as they are accepted and handed to the
+    writer, which INSERTs them in one transaction once `batch_size` rows are
+    pending or `flush_interval` seconds have passed. Ids are handed out up
+    front (through the broker, so they stay unique across workers) and every
+    broadcast message already carries the id admins use to delete it.
+
+    The highest id this worker has accepted is saved to message_sequence
+    with each batch (and after discarding unsaved messages), so a restart
+    after the table has been emptied still continues from there and clients
+    reconnecting with ?since=<id> are never handed reused ids.
+
+    A batch that keeps failing (a duplicate id, a value the database
+    rejects) would hold up every later write, so after `max_retries`
+    attempts it is written one row at a time and the rows that are
+    rejected are logged and dropped.
+    """
+
+    def __init__(self, batch_size: int = PERSIST_BATCH_SIZE, flush_interval: float = PERSIST_FLUSH_INTERVAL,
+                 max_retries: int = PERSIST_MAX_RETRIES, max_pending: int = PERSIST_MAX_PENDING):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.max_pending = max_pending
+        self.pending: List[HistoryRecord] = []
+        self.next_id: Optional[int] = None
+        self.high_water = 0  # Highest id submitted to this writer
+        self.saved_id = 0  # Highest id saved to message_sequence
+        self.task: Optional[asyncio.Task] = None
+        self._in_flight: Dict[int, str] = {}  # id -> room of the batch being written
+        self._cancelled: Set[int] = set()
+        self._batch_ready = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._tasks: Set[asyncio.Task] = set()  # Background deletes
+        self._attempts = 0  # Failed attempts at the batch at the head of the queue
+
+        # Stats
+        self.oldest_pending_at: Optional[float] = None
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.dropped = 0
+        self.last_batch_size = 0
+        self.last_flush_ms = 0.0
+
+    async def start(self, db):
+        """Seed the id counter from the database and start the flush loop"""
+        max_id = await db.scalar(select(func.max(Message.id))) or 0
+        self.saved_id = await db.scalar(select(MessageSequence.last_id).where(MessageSequence.id == 1)) or 0
+        self.high_water = max(max_id, self.saved_id)
+        self.next_id = self.high_water + 1
+        self.task = asyncio.create_task(self._run())
+
+    def allocate_id(self) -> int:
+        """Reserve the id for a new message"""
+        if self.next_id is None:
+            raise RuntimeError("Message writer has not been started")
+        message_id = self.next_id
+        self.next_id += 1
+        return message_id
+
+    def submit(self, record: HistoryRecord):
+        """Queue a message for the next batch"""
+        if len(self.pending) >= self.max_pending:
+            # The database has been unreachable for a while; don't grow without bound
+            self._drop([record], "queue_full")
+            return
+        if not self.pending:
+            self.oldest_pending_at = time.monotonic()
+        self.pending.append(record)
+        self.high_water = max(self.high_water, record.id)
+        if len(self.pending) >= self.batch_size:
+            self._batch_ready.set()
+
+    def observe_id(self, message_id: int):
+        """Keep the counter ahead of ids assigned elsewhere"""
+        if self.next_id is not None and message_id >= self.next_id:
+            self.next_id = message_id + 1
+
+    def cancel(self, message_id: int) -> bool:
+        """Drop a message that has not been written yet"""
+        if message_id in self._in_flight:
+            # Already being written - delete it once the batch lands
+            self._cancelled.add(message_id)
+            return True
+        for index, record in enumerate(self.pending):
+            if record.id == message_id:
+                del self.pending[index]
+                self._reset_lag()
+                return True
+        return False
+
+    def remove(self, message_id: int):
+        """Keep a deleted message out of the database
+
+        Cancels it if it hasn't been written yet. Otherwise it may have been
+        written just before the delete arrived, so the row is deleted in
+        the background, after any flush in progress.
+        """
+        if not self.cancel(message_id):
+            task = asyncio.create_task(self._delete_written(message_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _delete_written(self, message_id: int):
+        try:
+            async with self._lock:
+                await self._delete({message_id})
+        except Exception:
+            logger.exception(f"Failed to delete message {message_id}")
+
+    def has_pending(self, room: str) -> bool:
+        """Whether any message for the room is waiting to be written"""
+        return room in self._in_flight.values() or any(record.room == room for record in self.pending)
+
+    def discard(self, room: Optional[str] = None) -> int:
+        """Drop every message (in one room, if given) that has not been written yet"""
+        kept = [record for record in self.pending if room is not None and record.room != room]
+        dropped = len(self.pending) - len(kept)
+        self.pending = kept
+        self._cancelled |= {
+            message_id for message_id, record_room in self._in_flight.items()
+            if room is None or record_room == room
+        }
+        self._reset_lag()
+        return dropped
+
+    def _reset_lag(self):
+        if not self.pending:
+            self.oldest_pending_at = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+
+            try:
+                if self.pending or self.high_water > self.saved_id:
+                    with TASK_SECONDS.time("persist_flush"):
+                        await self.flush()
+            except Exception as e:
+                # Rows stay pending and are retried on the next tick
+                logger.error(f"Failed to persist message batch: {e}")
+                await asyncio.sleep(self.flush_interval)
+
+    async def flush(self):
+        """Write every pending message in batches of `batch_size`"""
+        async with self._lock:
+            while self.pending:
+                batch = self.pending[:self.batch_size]
+                written = {record.id for record in batch}
+                started = time.perf_counter()
+                self._in_flight = {record.id: record.room for record in batch}
+                try:
+                    if self._attempts < self.max_retries:
+                        await self._write_batch(batch, self.high_water)
+                    else:
+                        await self._write_rows(batch)
+                except Exception:
+                    self.failures += 1
+                    self._attempts += 1
+                    raise
+                finally:
+                    self._in_flight = {}
+                self._attempts = 0
+
+                # Only drop what was written; new rows may have arrived meanwhile
+                self.pending = [r for r in self.pending if r.id not in written]
+                self.oldest_pending_at = time.monotonic() if self.pending else None
+
+                cancelled = written & self._cancelled
+                if cancelled:
+                    await self._delete(cancelled)
+                    self._cancelled -= cancelled
+
+                self.flushed += len(batch)
+                self.batches += 1
+                self.last_batch_size = len(batch)
+                self.last_flush_ms = (time.perf_counter() - started) * 1000
+
+            if self.high_water > self.saved_id:
+                # Unsaved messages were discarded; their ids were still broadcast
+                high_water = self.high_water
+                async with WriterSessionLocal() as db:
+                    await db.execute(_save_high_water(high_water))
+                    await db.commit()
+                self.saved_id = high_water
+
+    async def _write_batch(self, batch: List[HistoryRecord], high_water: int):
+        """INSERT a batch and the new high-water mark in one transaction"""
+        rows = [
+            {
+                "id": record.id,
+                "user": record.user,
+                "text": record.text,
+                "timestamp": record.timestamp,
+                "date_created": record.date_created,
+                "user_id": record.user_id,
+                "room": record.room
+            }
+            for record in batch
+        ]
+        async with WriterSessionLocal() as db:
+            try:
+                with DB_COMMIT_SECONDS.time():
+                    await db.execute(Message.__table__.insert(), rows)
+                    await db.execute(_save_high_water(high_water))
+                    await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+        self.saved_id = max(self.saved_id, high_water)
+
+    async def _write_rows(self, batch: List[HistoryRecord]):
+        """INSERT a batch that keeps failing one row at a time, dropping rejected rows
+
+        Stops at the first error that isn't about the row itself (the
+        database being unreachable), leaving the rest pending.
+        """
+        for index, record in enumerate(batch):
+            try:
+                await self._write_batch([record], self.high_water)
+            except (IntegrityError, DataError) as e:
+                logger.error(f"Dropping message {record.id} the database rejected: {e}",
+                             extra={"message_id": record.id, "room": record.room})
+                self._drop([record], "rejected")
+            except Exception:
+                # Keep what was written out of the retry
+                written = {r.id for r in batch[:index]}
+                self.pending = [r for r in self.pending if r.id not in written]
+                raise
+
+    def _drop(self, records: List[HistoryRecord], reason: str):
+        self.dropped += len(records)
+        PERSIST_DROPPED.labels(reason).inc(len(records))
+
+    @staticmethod
+    async def _delete(message_ids: Set[int]):
+        async with WriterSessionLocal() as db:
+            await db.execute(delete(Message).where(Message.id.in_(message_ids)))
+            await db.commit()
+
+    async def stop(self):
+        """Stop the flush loop and write whatever is still pending"""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+
+    def stats(self) -> dict:
+        """Queue depth and lag of the write-behind pipeline"""
+        lag = time.monotonic() - self.oldest_pending_at if self.oldest_pending_at else 0.0
+        return {
+            "pending": len(self.pending),
+            "lag_seconds": round(lag, 3),
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "last_batch_size": self.last_batch_size,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+        }
+
+
+def _save_high_water(message_id: int):
+    # Never lower it: another worker may have saved a higher id
+    return (
+        update(MessageSequence)
+        .where(MessageSequence.id == 1, MessageSequence.last_id < message_id)
+        .values(last_id=message_id)
+    )
+
+
+# Shared writer for this process
+message_writer = MessageWriter()
+PERSIST_PENDING.set_function(lambda: len(message_writer.pending))
@@ -0,0 +1,300 @@
+"""Token-bucket rate limiting with a bounded number of tracked keys"""
+from collections import OrderedDict
+from typing import Dict, Union
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import time
+from fastapi import HTTPException, Request, status
+from backend.config import (
+    RATE_LIMITS, RATE_LIMIT_MAX_KEYS, RATE_LIMIT_TTL, RATE_LIMIT_BACKEND,
+    RATE_LIMIT_SHM_PATH, TRUST_PROXY_HEADERS
+)
+from backend.metrics import Counter, Gauge
+
+RATE_LIMITED = Counter("rageroom_rate_limited_total", "Requests rejected by a rate limit", ["policy"])
+RATE_LIMIT_KEYS = Gauge("rageroom_rate_limit_keys", "Keys tracked by all rate limits")
+
+
+class TokenBucketLimiter:
+    """In-process token buckets, one per key, in LRU order
+
+    Each key holds just its token count and last refill time. A bucket
+    idle for `ttl` seconds is dropped; when `ttl` is at least the time to
+    refill from empty that loses nothing, since the bucket would be full
+    again anyway. Past `max_keys` the least recently used key is dropped.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float,
+                 max_keys: int = RATE_LIMIT_MAX_KEYS, ttl: float = RATE_LIMIT_TTL):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.ttl = min(ttl, burst / rate) if rate > 0 else ttl
+        self.buckets: "OrderedDict[str, list]" = OrderedDict()  # key -> [tokens, updated]
+        self.rejected = 0
+        self.evicted = 0
+
+    def allow(self, key: str, cost: float = 1) -> bool:
+        """Take `cost` tokens from the key's bucket; False if there aren't enough"""
+        now = time.monotonic()
+        self._expire(now)
+
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [self.burst, now]
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+                self.evicted += 1
+        else:
+            self.buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] < cost:
+            self.rejected += 1
+            RATE_LIMITED.labels(self.name).inc()
+            return False
+        bucket[0] -= cost
+        return True
+
+    def retry_after(self, key: str, cost: float = 1) -> float:
+        """Seconds until the key could spend `cost` tokens"""
+        bucket = self.buckets.get(key)
+        if bucket is None or self.rate <= 0:
+            return 0.0
+        tokens = min(self.burst, bucket[0] + (time.monotonic() - bucket[1]) * self.rate)
+        return max(cost - tokens, 0) / self.rate
+
+    def _expire(self, now: float):
+        # Oldest-touched keys are at the front, so stop at the first fresh one
+        while self.buckets:
+            key, bucket = next(iter(self.buckets.items()))
+            if now - bucket[1] < self.ttl:
+                break
+            del self.buckets[key]
+
+    def __len__(self) -> int:
+        return len(self.buckets)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "rate": self.rate,
+            "burst": self.burst,
+            "keys": len(self.buckets),
+            "rejected": self.rejected,
+            "evicted": self.evicted,
+        }
+
+
+class SharedTokenBucketLimiter:
+    """Token buckets in a memory-mapped file shared by every worker
+
+    The file is a fixed-size open-addressing hash table of
+    (key hash, tokens, updated) slots. A key lives in one of `PROBES`
+    slots after its hash position. Each check locks just that window of
+    the file with an fcntl record lock, then reads and updates the slot in
+    place: two syscalls and a few struct calls, so a check costs
+    microseconds. Slots idle past `ttl` are reused, and when a window is
+    full its least recently updated slot is overwritten, so the table never
+    grows. Timestamps use CLOCK_MONOTONIC, which all processes share.
+
+    The header also holds a count of occupied slots, so len() is a single
+    read. Checks clear the expired slots they probe; a key that expires
+    where no check looks again stays counted until one does.
+    """
+
+    MAGIC = b"RRL2"
+    HEADER = struct.Struct("!4sI")  # magic, slot count
+    COUNT = struct.Struct("=q")  # occupied slots, after the header
+    TABLE = HEADER.size + COUNT.size
+    SLOT = struct.Struct("=Qdd")  # key hash, tokens, updated
+    PROBES = 8
+
+    def __init__(self, name: str, rate: float, burst: float, path: str,
+                 max_keys: int = RATE_LIMIT_MAX_KEYS, ttl: float = RATE_LIMIT_TTL):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.ttl = min(ttl, burst / rate) if rate > 0 else ttl
+        # Twice the key cap keeps probe windows short
+        self.slots = max(max_keys * 2, self.PROBES * 2)
+        self.path = path
+        self.size = self.TABLE + self.slots * self.SLOT.size
+        self.fd = os.open(path, os.O_CREAT | os.O_RDWR, 0o600)
+        self._prepare_file()
+        self.map = mmap.mmap(self.fd, self.size)
+        self.rejected = 0
+        self.evicted = 0
+
+    def _prepare_file(self):
+        # Workers start together: the first one to get the lock sizes the file
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(self.fd, self.HEADER.size, 0)
+            expected = self.HEADER.pack(self.MAGIC, self.slots)
+            if header != expected or os.fstat(self.fd).st_size != self.size:
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, self.size)
+                os.pwrite(self.fd, expected, 0)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        # Stable across processes (unlike hash()); 0 marks an empty slot
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "little") or 1
+
+    def allow(self, key: str, cost: float = 1) -> bool:
+        """Take `cost` tokens from the key's bucket; False if there aren't enough"""
+        key_hash = self._hash(key)
+        start = key_hash % (self.slots - self.PROBES + 1)
+        offset = self.TABLE + start * self.SLOT.size
+        length = self.PROBES * self.SLOT.size
+
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, length, offset)
+        try:
+            # Read the clock under the lock: a timestamp another worker wrote
+            # while we waited would otherwise be in our future, and the slot
+            # would look expired
+            now = time.monotonic()
+            slot_offset, tokens, updated, change = self._find(key_hash, offset, now)
+            if updated is None:
+                tokens = self.burst
+            else:
+                tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self.SLOT.pack_into(self.map, slot_offset, key_hash, tokens, now)
+            if change:
+                self._count(change)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, length, offset)
+
+        if not allowed:
+            self.rejected += 1
+            RATE_LIMITED.labels(self.name).inc()
+        return allowed
+
+    def _find(self, key_hash: int, offset: int, now: float):
+        """Slot offset for the key, with its tokens, update time (None if new)
+        and the change in occupied slots once the key is written"""
+        free = oldest = None
+        oldest_updated = now
+        change = 0
+        for index in range(self.PROBES):
+            slot_offset = offset + index * self.SLOT.size
+            stored, tokens, updated = self.SLOT.unpack_from(self.map, slot_offset)
+            expired = not stored or updated > now or now - updated >= self.ttl
+            if stored == key_hash and not expired:
+                return slot_offset, tokens, updated, change
+            if expired:
+                if stored:
+                    # Clear it so the occupied count drops
+                    self.SLOT.pack_into(self.map, slot_offset, 0, 0.0, 0.0)
+                    change -= 1
+                if free is None:
+                    free = slot_offset
+            elif updated <= oldest_updated:
+                oldest, oldest_updated = slot_offset, updated
+
+        if free is None:
+            free = oldest
+            self.evicted += 1
+        else:
+            change += 1
+        return free, self.burst, None, change
+
+    def _count(self, change: int):
+        # Windows never cover the header, so this lock doesn't wait on them
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, self.COUNT.size, self.HEADER.size)
+        try:
+            count, = self.COUNT.unpack_from(self.map, self.HEADER.size)
+            self.COUNT.pack_into(self.map, self.HEADER.size, count + change)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, self.COUNT.size, self.HEADER.size)
+
+    def retry_after(self, key: str, cost: float = 1) -> float:
+        """Seconds until the key could spend `cost` tokens"""
+        if self.rate <= 0:
+            return 0.0
+        key_hash = self._hash(key)
+        start = key_hash % (self.slots - self.PROBES + 1)
+        offset = self.TABLE + start * self.SLOT.size
+        now = time.monotonic()
+        for index in range(self.PROBES):
+            stored, tokens, updated = self.SLOT.unpack_from(self.map, offset + index * self.SLOT.size)
+            if stored == key_hash:
+                tokens = min(self.burst, tokens + (now - updated) * self.rate)
+                return max(cost - tokens, 0) / self.rate
+        return 0.0
+
+    def __len__(self) -> int:
+        """Occupied slots, shared by every worker (may include expired keys)"""
+        count, = self.COUNT.unpack_from(self.map, self.HEADER.size)
+        return max(count, 0)
+
+    def stats(self) -> dict:
+        return {
+            "backend": "shared",
+            "rate": self.rate,
+            "burst": self.burst,
+            "keys": len(self),
+            "rejected": self.rejected,  # by this worker
+            "evicted": self.evicted,
+        }
+
+
+Limiter = Union[TokenBucketLimiter, SharedTokenBucketLimiter]
+
+
+def create_limiter(name: str, backend: str = RATE_LIMIT_BACKEND) -> Limiter:
+    """Build the limiter for a policy in RATE_LIMITS"""
+    policy = RATE_LIMITS[name]
+    if backend == "memory":
+        return TokenBucketLimiter(name, policy["rate"], policy["burst"])
+    if backend == "shared":
+        return SharedTokenBucketLimiter(name, policy["rate"], policy["burst"], f"{RATE_LIMIT_SHM_PATH}.{name}")
+    raise ValueError(f"Unknown rate limit backend: {backend}")
+
+
+# One limiter per policy in this process
+limiters: Dict[str, Limiter] = {name: create_limiter(name) for name in RATE_LIMITS}
+RATE_LIMIT_KEYS.set_function(lambda: sum(len(limiter) for limiter in limiters.values()))
+
+
+def client_ip(scope: dict, headers) -> str:
+    """Client address, from X-Forwarded-For when behind a trusted proxy"""
+    if TRUST_PROXY_HEADERS:
+        forwarded = headers.get("x-forwarded-for")
+        if forwarded:
+            # The proxy appends the address it saw; earlier entries are client-supplied
+            return forwarded.split(",")[-1].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def rate_limit(policy: str):
+    """FastAPI dependency applying a rate-limit policy per client IP"""
+    limiter = limiters[policy]
+
+    async def check(request: Request):
+        key = client_ip(request.scope, request.headers)
+        if not limiter.allow(key):
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests. Please try again later.",
+                headers={"Retry-After": str(max(int(limiter.retry_after(key)) + 1, 1))}
+            )
+
+    return check
+
+
+def stats() -> dict:
+    return {name: limiter.stats() for name, limiter in limiters.items()}
@@ -0,0 +1,144 @@
+"""Daily rollover: start a new chat day at midnight and delete the old one"""
+from datetime import datetime, time as dt_time, timedelta
+from typing import Optional
+import asyncio
+import logging
+import time
+from sqlalchemy import delete, select
+from backend.config import ROLLOVER_DELETE_BATCH, ROLLOVER_BATCH_PAUSE_MS
+from backend.database import WriterSessionLocal
+from backend.frames import system_frame
+from backend.metrics import TASK_SECONDS
+from backend.models import Message
+from backend.persistence import message_writer
+from backend.rooms import rooms
+from backend.totals import totals
+from backend.utils import APP_TIMEZONE, now, today
+
+logger = logging.getLogger(__name__)
+
+# Longest single sleep, so a clock change or a suspended host is noticed
+MAX_SLEEP = 300
+
+
+def seconds_until_midnight() -> float:
+    """Seconds until the next midnight in the chat's timezone"""
+    current = now()
+    boundary = datetime.combine(current.date() + timedelta(days=1), dt_time(0), tzinfo=APP_TIMEZONE)
+    # timestamp() rather than subtraction, which ignores DST changes within a zone
+    return max(boundary.timestamp() - current.timestamp(), 0.0)
+
+
+class DailyRollover:
+    """Sleeps until midnight, switches every room to the new day, then purges
+
+    The in-memory switch happens in one step on the event loop, so clients
+    see an empty room and the notice immediately. The database delete runs
+    afterwards in batches of `batch_size` rows, each its own short
+    transaction, with a pause between them. On startup it deletes anything
+    a missed rollover left behind. Every worker runs its own rollover.
+    """
+
+    def __init__(self, batch_size: int = ROLLOVER_DELETE_BATCH,
+                 batch_pause: float = ROLLOVER_BATCH_PAUSE_MS / 1000):
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.date = today()
+        self.task: Optional[asyncio.Task] = None
+
+        # Stats
+        self.rollovers = 0
+        self.deleted = 0
+        self.batches = 0
+        self.last_purge_ms = 0.0
+
+    def start(self):
+        self.date = today()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def _run(self):
+        deleted = await self._purge(self.date)
+        if deleted:
+            logger.info(f"Deleted {deleted} messages left from earlier days", extra={"deleted": deleted})
+            await self._recount()
+
+        while True:
+            await asyncio.sleep(min(seconds_until_midnight(), MAX_SLEEP))
+            if today() != self.date:
+                await self.rollover()
+
+    async def rollover(self):
+        """Start today's chat in every room and delete earlier messages"""
+        started = time.perf_counter()
+        self.date = today()
+        frame = system_frame("Messages have been cleared for a new day!")
+        for room in rooms:
+            room.history.clear(self.date)
+            room.broadcast(frame)
+        totals.new_day(self.date)
+        self.rollovers += 1
+
+        # Write yesterday's last messages first so the purge catches them
+        await message_writer.flush()
+        deleted = await self._purge(self.date)
+        logger.info(f"Started {self.date}: deleted {deleted} messages", extra={"deleted": deleted})
+        await self._recount()
+        TASK_SECONDS.labels("midnight_clear").observe(time.perf_counter() - started)
+
+    async def purge_before(self, date: str) -> int:
+        """Delete messages dated before `date`, one batch per transaction"""
+        started = time.perf_counter()
+        oldest = select(Message.id).where(Message.date_created < date).limit(self.batch_size)
+        statement = delete(Message).where(Message.id.in_(oldest)).execution_options(synchronize_session=False)
+        total = 0
+        while True:
+            async with WriterSessionLocal() as db:
+                result = await db.execute(statement)
+                await db.commit()
+            total += result.rowcount
+            self.batches += 1
+            if result.rowcount < self.batch_size:
+                break
+            # Let inserts and other queries in between batches
+            await asyncio.sleep(self.batch_pause)
+        self.deleted += total
+        self.last_purge_ms = (time.perf_counter() - started) * 1000
+        return total
+
+    async def _purge(self, date: str) -> int:
+        try:
+            return await self.purge_before(date)
+        except Exception:
+            # Whatever is left goes at the next rollover or restart
+            logger.exception("Failed to delete old messages")
+            return 0
+
+    async def _recount(self):
+        # The purge can't be applied to the running totals message by message
+        try:
+            await totals.reconcile()
+        except Exception:
+            logger.exception("Failed to recount stats after purge")
+
+    def stats(self) -> dict:
+        return {
+            "date": self.date,
+            "next_rollover_in": round(seconds_until_midnight(), 1),
+            "rollovers": self.rollovers,
+            "deleted": self.deleted,
+            "batches": self.batches,
+            "last_purge_ms": round(self.last_purge_ms, 2),
+        }
+
+
+# Rollover for this process
+rollover = DailyRollover()
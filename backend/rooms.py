@@ -0,0 +1,249 @@
+"""Chat rooms: each with its own clients and history"""
+from typing import Dict, List, Optional
+import asyncio
+import json
+import re
+from sqlalchemy import select
+from backend.config import DEFAULT_ROOM, MAX_ROOMS, HISTORY_REPLAY_LIMIT, BROADCAST_COALESCE
+from backend.connections import ConnectionManager, BroadcastCoalescer, ConnectionSupervisor
+from backend.database import SessionLocal
+from backend.frames import Frame
+from backend.history import MessageHistory, HistoryRecord
+from backend.metrics import CONNECTED_CLIENTS, ROOMS
+from backend.models import Message
+from backend.persistence import message_writer
+from backend.utils import today
+
+ROOM_NAME_PATTERN = re.compile(r"^[a-z0-9_-]{1,50}$")
+
+
+class Room:
+    """A chat room: broadcast scope and history buffer"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.manager = ConnectionManager()
+        self.coalescer = BroadcastCoalescer(self.manager) if BROADCAST_COALESCE else None
+        self.history = MessageHistory(room=name)
+        self._replay_key = None
+        self._replay_frame: Optional[Frame] = None
+        self.loaded = False  # History read from the database
+        self.joining = 0  # Clients between lookup and connect
+        self._load_lock = asyncio.Lock()
+
+    async def ensure_loaded(self):
+        """Fill the history from the database the first time the room is joined"""
+        async with self._load_lock:
+            if not self.loaded:
+                async with SessionLocal() as db:
+                    await self.history.load(db)
+                self.loaded = True
+
+    def broadcast(self, frame: Frame):
+        """Send a frame to everyone in the room, coalescing bursts if enabled"""
+        if self.coalescer is not None:
+            self.coalescer.add(frame)
+        else:
+            self.manager.broadcast(frame)
+
+    async def history_frame(self, before: Optional[int] = None, limit: int = HISTORY_REPLAY_LIMIT) -> Frame:
+        """Build one history frame with up to `limit` of today's messages
+
+        Without `before` this is the most recent page; with it, the page of
+        messages older than that id. Pages are served from the in-memory
+        history and only fall back to the DB past the end of the buffer.
+        `has_more` tells the client whether it can keep scrolling back.
+        The initial page is cached, so a wave of joins shares one encoding.
+        """
+        history = self.history
+        cache_key = (history.version, limit)
+        if before is None and self._replay_key == cache_key:
+            return self._replay_frame
+
+        records, has_more = history.page(before, limit)
+        frames = [record.frame for record in records]
+
+        if len(records) < limit and history.truncated:
+            cursor = records[0].id if records else history.oldest_id()
+            if before is not None and (cursor is None or before < cursor):
+                cursor = before
+            older, has_more = await self._load_older(cursor, limit - len(records))
+            frames = older + frames
+
+        frame = self._history_frame(frames, before=before, has_more=has_more)
+
+        if before is None:
+            self._replay_key = cache_key
+            self._replay_frame = frame
+        return frame
+
+    def empty_page(self, before: int) -> Frame:
+        """Page with no messages that keeps has_more set, so the client can ask again later"""
+        return self._history_frame([], before=before, has_more=True)
+
+    def catch_up_frame(self, since: int, limit: int = HISTORY_REPLAY_LIMIT) -> Optional[Frame]:
+        """History frame with only the messages newer than `since`
+
+        Used when a client reconnects with the last id it saw. Returns None
+        if the gap is too large to serve from memory, so the caller falls
+        back to a full replay.
+        """
+        records = self.history.since(since, limit)
+        if records is None:
+            return None
+        return self._history_frame([record.frame for record in records], since=since)
+
+    def _history_frame(self, frames: List[Frame], before: Optional[int] = None,
+                       has_more: bool = False, since: Optional[int] = None) -> Frame:
+        payload = {
+            "type": "history",
+            "room": self.name,
+            "messages": [frame.payload for frame in frames],
+            "before": before,
+            "since": since,
+            "has_more": has_more
+        }
+        # Splice the already-encoded messages into the JSON text
+        text = '{"type": "history", "room": %s, "messages": [%s], "before": %s, "since": %s, "has_more": %s}' % (
+            json.dumps(self.name), ", ".join(frame.text for frame in frames),
+            json.dumps(before), json.dumps(since), json.dumps(has_more)
+        )
+        return Frame(payload, text=text)
+
+    async def _load_older(self, before: Optional[int], limit: int):
+        """Read a page of today's messages that fell out of the history buffer"""
+        query = select(Message).where(
+            Message.date_created == self.history.date, Message.room == self.name
+        )
+        if before is not None:
+            query = query.where(Message.id < before)
+        async with SessionLocal() as db:
+            result = await db.execute(query.order_by(Message.id.desc()).limit(limit + 1))
+            page = result.scalars().all()
+
+        has_more = len(page) > limit
+        return [HistoryRecord.from_message(msg).frame for msg in reversed(page[:limit])], has_more
+
+    def stats(self) -> dict:
+        stats = {
+            "room": self.name,
+            "clients": len(self.manager),
+            "today_messages": self.history.count,
+        }
+        if self.coalescer is not None:
+            stats["coalescing"] = self.coalescer.stats()
+        return stats
+
+
+class RoomRegistry:
+    """Rooms that exist in this process
+
+    A room is created when the first client joins and removed when the last
+    one leaves (the default room stays), so abandoned rooms don't hold on
+    to MAX_ROOMS slots.
+    """
+
+    def __init__(self, max_rooms: int = MAX_ROOMS):
+        self.max_rooms = max_rooms
+        self.rooms: Dict[str, Room] = {DEFAULT_ROOM: Room(DEFAULT_ROOM)}
+
+    def __iter__(self):
+        return iter(list(self.rooms.values()))
+
+    @staticmethod
+    def valid_name(name: str) -> bool:
+        return bool(ROOM_NAME_PATTERN.match(name))
+
+    def get(self, name: str, create: bool = True) -> Optional[Room]:
+        """Look up a room, creating it if allowed and there is space
+
+        Returns None for invalid names or when MAX_ROOMS is reached.
+        """
+        room = self.rooms.get(name)
+        if room is None and create and self.valid_name(name):
+            if len(self.rooms) >= self.max_rooms:
+                # Rooms loaded at startup may have nobody in them
+                for idle in self:
+                    if self.release(idle):
+                        break
+            if len(self.rooms) < self.max_rooms:
+                room = self.rooms[name] = Room(name)
+        return room
+
+    def release(self, room: Room) -> bool:
+        """Remove a room nobody is in or joining; returns True if it was removed
+
+        Rooms with messages still waiting to be written are kept, so a
+        later join doesn't load a history that is missing them.
+        """
+        if (
+            room.name == DEFAULT_ROOM
+            or len(room.manager)
+            or room.joining
+            or message_writer.has_pending(room.name)
+            or self.rooms.get(room.name) is not room
+        ):
+            return False
+        del self.rooms[room.name]
+        return True
+
+    @property
+    def default(self) -> Room:
+        return self.rooms[DEFAULT_ROOM]
+
+    @property
+    def client_count(self) -> int:
+        return sum(len(room.manager) for room in self)
+
+    @property
+    def message_count(self) -> int:
+        return sum(room.history.count for room in self)
+
+    def clients(self):
+        """Every connected client in every room"""
+        for room in self:
+            yield from room.manager.clients
+
+    def find_message(self, message_id: int) -> Optional[Room]:
+        """Room whose buffered history holds this message id"""
+        for room in self:
+            if message_id in room.history.by_id:
+                return room
+        return None
+
+    async def load(self, db):
+        """Create every room with messages today and fill its history"""
+        result = await db.execute(
+            select(Message.room).where(Message.date_created == today()).distinct()
+        )
+        for name in result.scalars().all():
+            self.get(name)
+        for room in self:
+            await room.history.load(db)
+            room.loaded = True
+
+    def connection_stats(self) -> dict:
+        """Send queue stats summed over every room"""
+        per_room = [room.manager.stats() for room in self]
+        return {
+            "clients": sum(s["clients"] for s in per_room),
+            "queue_size": self.default.manager.queue_size,
+            "policy": self.default.manager.policy,
+            "queued_frames": sum(s["queued_frames"] for s in per_room),
+            "max_queue_depth": max((s["max_queue_depth"] for s in per_room), default=0),
+            "dropped_frames": sum(s["dropped_frames"] for s in per_room),
+            "slow_disconnects": sum(s["slow_disconnects"] for s in per_room),
+        }
+
+    def stats(self) -> List[dict]:
+        return [room.stats() for room in self]
+
+
+# Rooms for this process
+rooms = RoomRegistry()
+
+CONNECTED_CLIENTS.set_function(lambda: rooms.client_count)
+ROOMS.set_function(lambda: len(rooms.rooms))
+
+# Liveness checks for every client in every room
+supervisor = ConnectionSupervisor(rooms.clients)
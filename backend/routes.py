@@ -1,11 +1,13 @@
 """API routes"""
-from fastapi import APIRouter, Depends
-from fastapi.responses import FileResponse
-from datetime import datetime
-from sqlalchemy.orm import Session
-from backend.database import get_db
-from backend.models import Message
-from backend.config import STATIC_DIR, DAILY_TOPIC, DAILY_RULES
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse, JSONResponse, Response
+from backend.rooms import rooms
+from backend.database import SessionLocal
+from backend.history import MessageHistory
+from backend.health import readiness
+from backend.utils import now as local_now
+from backend import metrics
+from backend.config import STATIC_DIR, DAILY_TOPIC, DAILY_RULES, DEFAULT_ROOM, HISTORY_REPLAY_LIMIT
 
 router = APIRouter()
 
@@ -16,26 +18,48 @@ async def get_index():
     return FileResponse(STATIC_DIR / "index.html")
 
 
-@router.get("/health")
-async def health_check(db: Session = Depends(get_db)):
-    """Health check endpoint for Render"""
-    from backend.websocket import connected_clients
+@router.get("/livez")
+async def liveness_check():
+    """The process is up and its event loop is answering"""
+    return {"status": "alive"}
+
+
+@router.get("/readyz")
+async def readiness_check():
+    """Whether this worker should get traffic, from the last background check"""
+    ready = readiness.ready
+    body = {
+        "status": "ready" if ready else "not ready",
+        "checks": readiness.checks,
+        "checked_seconds_ago": readiness.stats()["checked_seconds_ago"],
+        "connected_clients": rooms.client_count,
+        "message_count": rooms.message_count,
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
 
-    today = datetime.now().strftime("%Y-%m-%d")
-    message_count = db.query(Message).filter(Message.date_created == today).count()
 
+@router.get("/health")
+async def health_check():
+    """In-memory counts for this worker (no readiness checks)"""
     return {
         "status": "healthy",
-        "message_count": message_count,
-        "connected_clients": len(connected_clients),
-        "date": today
+        "message_count": rooms.message_count,
+        "connected_clients": rooms.client_count,
+        "rooms": len(rooms.rooms),
+        "date": rooms.default.history.date
     }
 
 
+@router.get("/metrics")
+async def get_metrics():
+    """Metrics for this worker in Prometheus text format"""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @router.get("/api/today")
 async def get_today():
     """Get today's topic information"""
-    now = datetime.now()
+    now = local_now()
     return {
         "date": now.strftime("%Y-%m-%d"),
         "time": now.strftime("%H:%M:%S"),
@@ -46,12 +70,18 @@ async def get_today():
 
 
 @router.get("/api/messages", response_model=dict)
-async def get_messages(db: Session = Depends(get_db)):
-    """Get message history for new users"""
-    today = datetime.now().strftime("%Y-%m-%d")
-    messages = db.query(Message).filter(
-        Message.date_created == today
-    ).order_by(Message.timestamp).all()
-
-    return {"messages": [msg.to_dict() for msg in messages]}
+async def get_messages(room: str = DEFAULT_ROOM):
+    """Get a room's message history (from memory while anyone is in the room)"""
+    found = rooms.get(room, create=False)
+    if found is not None:
+        history = found.history
+    elif not rooms.valid_name(room):
+        raise HTTPException(status_code=400, detail="Invalid room name")
+    else:
+        # Nobody is in it on this worker; read its latest messages instead
+        history = MessageHistory(room=room, maxlen=HISTORY_REPLAY_LIMIT)
+        async with SessionLocal() as db:
+            await history.load(db)
+    body = '{"messages": [%s]}' % ", ".join(record.json for record in history.records)
+    return Response(content=body, media_type="application/json")
 
@@ -0,0 +1,214 @@
+"""Running totals for the admin dashboard, kept without COUNT queries"""
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Optional
+import asyncio
+import logging
+import time
+from sqlalchemy import func, select
+from backend.config import STATS_SNAPSHOT_INTERVAL, STATS_RECONCILE_INTERVAL, STATS_TOP_USERS
+from backend.database import SessionLocal, WriterSessionLocal
+from backend.metrics import TASK_SECONDS
+from backend.models import DailyStats, Message, User
+from backend.persistence import message_writer
+from backend.utils import today
+
+logger = logging.getLogger(__name__)
+
+
+class RunningTotals:
+    """Users, messages (all time and today, per room) and per-nickname counts
+
+    Updated from broker events, which every worker receives, so each worker
+    holds the same numbers and reading them costs nothing. Every
+    `snapshot_interval` the totals are saved to today's daily_stats row;
+    every `reconcile_interval` (and after a rollover or a room clear, which
+    can't be applied exactly) they are recounted from the database and the
+    difference is reported as drift.
+    """
+
+    def __init__(self, snapshot_interval: float = STATS_SNAPSHOT_INTERVAL,
+                 reconcile_interval: float = STATS_RECONCILE_INTERVAL):
+        self.snapshot_interval = snapshot_interval
+        self.reconcile_interval = reconcile_interval
+        self.date = today()
+        self.users = 0
+        self.messages_total = 0
+        self.messages_today = 0
+        self.room_totals: Counter = Counter()
+        self.room_today: Counter = Counter()
+        self.user_today: Counter = Counter()  # nickname -> messages today
+        self.peak_clients = 0  # Today, on this worker
+        self.task: Optional[asyncio.Task] = None
+        self._reconcile_requested = False
+
+        # Stats
+        self.reconciled_at: Optional[float] = None
+        self.last_drift = 0
+        self.snapshots = 0
+
+    # Events
+
+    def message_added(self, room: str, user: str, date_created: str):
+        self.messages_total += 1
+        self.room_totals[room] += 1
+        if date_created == self.date:
+            self.messages_today += 1
+            self.room_today[room] += 1
+            self.user_today[user] += 1
+
+    def message_removed(self, room: str, user: str, date_created: str):
+        self.messages_total = max(self.messages_total - 1, 0)
+        _decrement(self.room_totals, room)
+        if date_created == self.date:
+            self.messages_today = max(self.messages_today - 1, 0)
+            _decrement(self.room_today, room)
+            _decrement(self.user_today, user)
+
+    def cleared(self, room: Optional[str] = None):
+        if room is None:
+            self.messages_total = self.messages_today = 0
+            self.room_totals.clear()
+            self.room_today.clear()
+            self.user_today.clear()
+            return
+        self.messages_total = max(self.messages_total - self.room_totals.pop(room, 0), 0)
+        self.messages_today = max(self.messages_today - self.room_today.pop(room, 0), 0)
+        # Per-nickname counts aren't kept per room
+        self._reconcile_requested = True
+
+    def user_added(self):
+        self.users += 1
+
+    def observe_clients(self, count: int):
+        if count > self.peak_clients:
+            self.peak_clients = count
+
+    def new_day(self, date: str):
+        """Reset today's counts; the purge that follows is picked up by a recount"""
+        self.date = date
+        self.messages_today = 0
+        self.room_today.clear()
+        self.user_today.clear()
+        self.peak_clients = 0
+        self._reconcile_requested = True
+
+    # Reads
+
+    def counts(self, room: Optional[str] = None) -> dict:
+        if room:
+            return {
+                "users": self.users,
+                "messages_total": self.room_totals.get(room, 0),
+                "messages_today": self.room_today.get(room, 0),
+            }
+        return {"users": self.users, "messages_total": self.messages_total, "messages_today": self.messages_today}
+
+    def top_users(self, limit: int = STATS_TOP_USERS) -> list:
+        return [{"user": user, "messages": count} for user, count in self.user_today.most_common(limit)]
+
+    # Background work
+
+    async def reconcile(self):
+        """Recount everything from the database"""
+        started = time.perf_counter()
+        await message_writer.flush()
+        date = today()
+        async with SessionLocal() as db:
+            users = await db.scalar(select(func.count(User.id)))
+            room_totals = dict((await db.execute(
+                select(Message.room, func.count(Message.id)).group_by(Message.room)
+            )).all())
+            room_today = dict((await db.execute(
+                select(Message.room, func.count(Message.id))
+                .where(Message.date_created == date).group_by(Message.room)
+            )).all())
+            user_today = dict((await db.execute(
+                select(Message.user, func.count(Message.id))
+                .where(Message.date_created == date).group_by(Message.user)
+            )).all())
+            if self.peak_clients == 0:
+                # Restarted today: carry on from the saved peak
+                snapshot = await db.get(DailyStats, date)
+                if snapshot is not None:
+                    self.peak_clients = snapshot.peak_clients
+
+        messages_total = sum(room_totals.values())
+        self.last_drift = messages_total - self.messages_total
+        self.date = date
+        self.users = users
+        self.messages_total = messages_total
+        self.messages_today = sum(room_today.values())
+        self.room_totals = Counter(room_totals)
+        self.room_today = Counter(room_today)
+        self.user_today = Counter(user_today)
+        self.reconciled_at = time.time()
+        self._reconcile_requested = False
+        TASK_SECONDS.labels("stats_reconcile").observe(time.perf_counter() - started)
+
+    async def snapshot(self):
+        """Save the totals to today's daily_stats row"""
+        async with WriterSessionLocal() as db:
+            row = await db.get(DailyStats, self.date)
+            if row is None:
+                row = DailyStats(date=self.date, peak_clients=0)
+                db.add(row)
+            row.users = self.users
+            row.messages_total = self.messages_total
+            row.messages_today = self.messages_today
+            # Each worker only knows its own peak; keep the highest
+            row.peak_clients = max(row.peak_clients, self.peak_clients)
+            row.updated_at = datetime.now(timezone.utc).replace(tzinfo=None)
+            await db.commit()
+        self.snapshots += 1
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        try:
+            await self.snapshot()
+        except Exception:
+            logger.exception("Failed to save stats snapshot")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            try:
+                due = self.reconciled_at is None or time.time() - self.reconciled_at >= self.reconcile_interval
+                if due or self._reconcile_requested:
+                    await self.reconcile()
+                    if self.last_drift:
+                        logger.info(f"Stats recount corrected message total by {self.last_drift}",
+                                    extra={"drift": self.last_drift})
+                await self.snapshot()
+            except Exception:
+                # Another worker may have inserted today's row first; retry next time
+                logger.exception("Failed to reconcile or save stats")
+
+    def stats(self) -> dict:
+        return {
+            "date": self.date,
+            "peak_clients": self.peak_clients,
+            "reconciled_seconds_ago": round(time.time() - self.reconciled_at, 1) if self.reconciled_at else None,
+            "last_drift": self.last_drift,
+            "snapshots": self.snapshots,
+        }
+
+
+def _decrement(counter: Dict[str, int], key: str):
+    if counter.get(key, 0) > 1:
+        counter[key] -= 1
+    else:
+        counter.pop(key, None)
+
+
+# Totals for this process
+totals = RunningTotals()
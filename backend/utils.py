@@ -1,29 +1,18 @@
 """Utility functions for message handling"""
-from collections import deque
-from typing import Dict
-import time
-from backend.config import MAX_MESSAGES_PER_MINUTE
+from datetime import datetime, tzinfo
+from typing import Optional
+from zoneinfo import ZoneInfo
+from backend.config import TIMEZONE
 
-# Rate limiting: track messages per user
-user_message_timestamps: Dict[str, deque] = {}
+# None means the server's local time
+APP_TIMEZONE: Optional[tzinfo] = ZoneInfo(TIMEZONE) if TIMEZONE else None
 
 
-def is_rate_limited(user: str) -> bool:
-    """Check if user is sending too many messages"""
-    now = time.time()
+def now() -> datetime:
+    """Current time in the chat's timezone"""
+    return datetime.now(APP_TIMEZONE)
 
-    if user not in user_message_timestamps:
-        user_message_timestamps[user] = deque(maxlen=MAX_MESSAGES_PER_MINUTE)
-
-    # Remove timestamps older than 1 minute
-    user_timestamps = user_message_timestamps[user]
-    while user_timestamps and now - user_timestamps[0] > 60:
-        user_timestamps.popleft()
-
-    # Check if user exceeded limit
-    if len(user_timestamps) >= MAX_MESSAGES_PER_MINUTE:
-        return True
-
-    user_timestamps.append(now)
-    return False
 
+def today() -> str:
+    """Today's date as stored in Message.date_created (YYYY-MM-DD)"""
+    return now().strftime("%Y-%m-%d")
@@ -1,155 +1,310 @@
 """WebSocket handling and background tasks"""
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import Set
-from datetime import datetime, time as dt_time
+from datetime import datetime
+from typing import Optional
 import asyncio
-import json
+import itertools
+import logging
+import time
 from pydantic import ValidationError
 from backend.database import SessionLocal
-from backend.models import Message
 from backend.schemas import MessageCreate
-from backend.utils import is_rate_limited
-from backend.config import MAX_CONNECTIONS
-
-# Track connected clients
-connected_clients: Set[WebSocket] = set()
-
-
-async def websocket_endpoint(websocket: WebSocket):
-    """Handle WebSocket connections"""
-    # Check connection limit
-    if len(connected_clients) >= MAX_CONNECTIONS:
+from backend.utils import today
+from backend.config import MAX_CONNECTIONS, HISTORY_REPLAY_LIMIT, HISTORY_PAGE_SIZE, DEFAULT_ROOM
+from backend.frames import (
+    Frame, MSGPACK_SUBPROTOCOL, BEARER_SUBPROTOCOL_PREFIX, negotiate_subprotocol, loads, system_frame
+)
+from backend.history import HistoryRecord
+from backend.persistence import message_writer
+from backend.broker import broker
+from backend.rooms import rooms, supervisor
+from backend.ratelimit import limiters, client_ip
+from backend.auth import user_for_token
+from backend.auth_cache import auth_cache
+from backend.logs import connection_id
+from backend.totals import totals
+from backend.metrics import (
+    MESSAGES_RECEIVED, MESSAGES_BROADCAST, MESSAGES_REJECTED, HISTORY_REPLAY_SECONDS, TASK_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+# Connects and disconnects are sampled and capped (LOG_SAMPLING, LOG_RATE_CAPS)
+connection_logger = logging.getLogger("backend.websocket.connections")
+
+# Numbers connections in this worker, for rate-limit keys and log records
+_connection_ids = itertools.count(1)
+
+# Application close codes (4000-4999) for a rejected sign-in
+CLOSE_INVALID_TOKEN = 4401
+CLOSE_ACCOUNT_DISABLED = 4403
+
+
+def _handshake_token(websocket: WebSocket) -> Optional[str]:
+    """JWT from the bearer subprotocol
+
+    There is no query-string fallback: uvicorn's access log records the
+    full URL of every WebSocket, so a token there would end up in the logs.
+    """
+    for requested in websocket.scope.get("subprotocols", []):
+        if requested.startswith(BEARER_SUBPROTOCOL_PREFIX):
+            return requested[len(BEARER_SUBPROTOCOL_PREFIX):] or None
+    return None
+
+
+async def websocket_endpoint(websocket: WebSocket, room_name: str = DEFAULT_ROOM):
+    """Handle WebSocket connections to one room"""
+    # Check connection limit (shared by all rooms)
+    if rooms.client_count >= MAX_CONNECTIONS:
         await websocket.close(code=1008, reason="Server full")
         return
 
-    await websocket.accept()
-    connected_clients.add(websocket)
+    # Reconnect storms and connection floods are limited per IP
+    ip = client_ip(websocket.scope, websocket.headers)
+    if not limiters["ws_connect"].allow(ip):
+        await websocket.close(code=1008, reason="Too many connections")
+        return
 
-    # Get database session
-    db = SessionLocal()
+    room = rooms.get(room_name)
+    if room is None:
+        reason = "Invalid room name" if not rooms.valid_name(room_name) else "Too many rooms"
+        await websocket.close(code=1008, reason=reason)
+        return
 
+    # Counted as joining until connected, so the room isn't removed meanwhile
+    room.joining += 1
     try:
-        # Small delay to ensure WebSocket is fully ready
-        await asyncio.sleep(0.1)
-
-        # Send message history to new user
-        today = datetime.now().strftime("%Y-%m-%d")
-        messages = db.query(Message).filter(
-            Message.date_created == today
-        ).order_by(Message.timestamp).all()
+        await room.ensure_loaded()
+
+        # Signing in is optional and checked once here, not on every message
+        user = None
+        token = _handshake_token(websocket)
+        if token:
+            async with SessionLocal() as db:
+                user = await user_for_token(token, db)
+
+        # Clients may opt in to MessagePack frames via Sec-WebSocket-Protocol
+        subprotocol = negotiate_subprotocol(websocket.scope.get("subprotocols", []))
+        await websocket.accept(subprotocol=subprotocol)
+        if token and (user is None or not user.is_active):
+            # Closed after accepting so the browser gets the code and can drop the token
+            if user is None:
+                await websocket.close(code=CLOSE_INVALID_TOKEN, reason="Invalid token")
+            else:
+                await websocket.close(code=CLOSE_ACCOUNT_DISABLED, reason="Account disabled")
+            return
+
+        client = room.manager.connect(websocket, binary=subprotocol == MSGPACK_SUBPROTOCOL)
+    finally:
+        room.joining -= 1
+        rooms.release(room)  # Only if this client never got in
+
+    conn = f"{broker.origin}:{next(_connection_ids)}"
+    connection_id.set(conn)
+    # Each room has its own limits. Guests get a bucket per connection plus
+    # a looser one per IP, so a reconnect can't reset the room's allowance
+    # but a shared NAT doesn't squeeze everyone behind it into one bucket
+    if user is not None:
+        client.user_id = user.id
+        rate_key = f"{room.name}:user:{user.id}"
+        ip_key = None
+    else:
+        rate_key = f"{room.name}:conn:{conn}"
+        ip_key = f"{room.name}:ip:{ip}"
+    totals.observe_clients(rooms.client_count)
+    connected_at = time.monotonic()
+    close_code = None
+    connection_logger.info("Client connected", extra={
+        "room": room.name, "subprotocol": subprotocol, "user_id": client.user_id
+    })
 
-        print(f"Sending {len(messages)} messages to new user")
-        for msg in messages:
-            await websocket.send_text(json.dumps(msg.to_dict()))
+    try:
+        # A reconnecting client passes the last id it saw and only gets what
+        # it missed; everyone else gets the most recent history in one frame
+        started = time.perf_counter()
+        replay, kind = None, "catch_up"
+        since = websocket.query_params.get("since")
+        if since is not None and since.isdigit():
+            replay = room.catch_up_frame(int(since), limit=HISTORY_REPLAY_LIMIT)
+        if replay is None:
+            replay, kind = await room.history_frame(limit=HISTORY_REPLAY_LIMIT), "full"
+        client.send_control(replay)
+        HISTORY_REPLAY_SECONDS.labels(kind).observe(time.perf_counter() - started)
 
         while True:
-            data = await websocket.receive_text()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            client.pong()
 
             try:
-                msg_data = json.loads(data)
+                msg_data = loads(message)
+
+                # Reply to the supervisor's ping; pong() already counted it
+                if msg_data.get("type") == "pong":
+                    continue
 
-                # Validate with Pydantic
+                client.touch()
+
+                # Scroll-back request for older history
+                if msg_data.get("type") == "load_older":
+                    try:
+                        before = int(msg_data.get("before"))
+                    except (TypeError, ValueError):
+                        before = None
+                    if before is None:
+                        continue
+                    # Pages past the in-memory buffer come from the database
+                    if not limiters["ws_history"].allow(rate_key):
+                        client.send_control(room.empty_page(before))
+                        continue
+                    with HISTORY_REPLAY_SECONDS.time("page"):
+                        client.send_control(await room.history_frame(before=before, limit=HISTORY_PAGE_SIZE))
+                    continue
+
+                MESSAGES_RECEIVED.inc()
+
+                # Validate with Pydantic; signed-in users always post under their username
                 try:
-                    message_create = MessageCreate(**msg_data)
+                    if user is not None:
+                        message_create = MessageCreate(user=user.username, text=msg_data.get("text"))
+                    else:
+                        message_create = MessageCreate(**msg_data)
                 except ValidationError as e:
-                    await websocket.send_text(json.dumps({
-                        "user": "System",
-                        "text": f"Invalid message: {e.errors()[0]['msg']}",
-                        "timestamp": datetime.now().isoformat()
-                    }))
+                    MESSAGES_REJECTED.labels("invalid").inc()
+                    client.send(system_frame(f"Invalid message: {e.errors()[0]['msg']}"))
                     continue
 
                 # Rate limiting
-                if is_rate_limited(message_create.user):
-                    await websocket.send_text(json.dumps({
-                        "user": "System",
-                        "text": "You're sending messages too quickly. Please slow down.",
-                        "timestamp": datetime.now().isoformat()
-                    }))
+                if not limiters["ws_message"].allow(rate_key) or (
+                        ip_key is not None and not limiters["ws_guest_ip"].allow(ip_key)):
+                    MESSAGES_REJECTED.labels("rate_limit").inc()
+                    client.send(system_frame("You're sending messages too quickly. Please slow down."))
                     continue
 
-                # Save to database
-                db_message = Message(
-                    user=message_create.user,
-                    text=message_create.text,
-                    timestamp=datetime.now(),
-                    date_created=datetime.now().strftime("%Y-%m-%d")
-                )
-                db.add(db_message)
-                db.commit()
-                db.refresh(db_message)
-
-                # Broadcast to all clients
-                await broadcast(db_message.to_dict())
-
-            except json.JSONDecodeError:
-                # Invalid JSON format
-                await websocket.send_text(json.dumps({
-                    "user": "System",
-                    "text": "Invalid message format",
-                    "timestamp": datetime.now().isoformat()
-                }))
-
-    except WebSocketDisconnect:
-        connected_clients.discard(websocket)
+                # Publish to every worker; the broker assigns the id and
+                # deliver_event broadcasts it and queues it for saving
+                await broker.publish({
+                    "type": "message",
+                    "id": None,
+                    "room": room.name,
+                    "user": message_create.user,
+                    "text": message_create.text,
+                    "timestamp": datetime.now().isoformat(),
+                    "date_created": today(),
+                    "user_id": client.user_id
+                })
+
+            except (ValueError, TypeError, AttributeError):
+                # Undecodable frame or not a JSON object
+                MESSAGES_REJECTED.labels("malformed").inc()
+                client.send(system_frame("Invalid message format"))
+
+    except WebSocketDisconnect as e:
+        close_code = e.code
     finally:
-        db.close()
-
-
-async def broadcast(message: dict):
-    """Broadcast message to all connected clients"""
-    message_json = json.dumps(message)
-    to_remove = []
-
-    for client in connected_clients:
-        try:
-            await client.send_text(message_json)
-        except Exception:
-            to_remove.append(client)
-
-    for c in to_remove:
-        connected_clients.discard(c)
-
-
-async def broadcast_system_message(text: str):
+        room.manager.disconnect(client)
+        rooms.release(room)
+        connection_logger.info("Client disconnected", extra={
+            "room": room.name,
+            "close_code": close_code,
+            "duration_seconds": round(time.monotonic() - connected_at, 1),
+        })
+
+
+def deliver_event(event: dict):
+    """Apply a broker event to this worker's history, writer and clients
+
+    Every worker receives every event in the same order. Only the worker
+    that accepted a message writes it to the database.
+    """
+    kind = event.get("type")
+
+    if kind == "message":
+        # Only rooms someone here is in; the others load it from the
+        # database when they are next joined
+        room = rooms.get(event.get("room", DEFAULT_ROOM), create=False)
+        record = HistoryRecord(
+            id=event["id"],
+            user=event["user"],
+            text=event["text"],
+            timestamp=datetime.fromisoformat(event["timestamp"]),
+            date_created=event["date_created"],
+            user_id=event.get("user_id"),
+            room=event.get("room", DEFAULT_ROOM),
+            origin=event.get("origin")
+        )
+        message_writer.observe_id(record.id)
+        totals.message_added(record.room, record.user, record.date_created)
+        if room is not None:
+            room.history.append(record)
+
+            # Broadcast the pre-serialized record to the room right away,
+            # the background writer saves it with the next batch
+            room.broadcast(record.frame)
+            MESSAGES_BROADCAST.inc()
+        if record.origin == broker.origin:
+            message_writer.submit(record)
+
+    elif kind == "broadcast":
+        frame = Frame(event["message"])
+        for room in _target_rooms(event.get("room")):
+            room.broadcast(frame)
+
+    elif kind == "evict":
+        room = rooms.find_message(event["id"])
+        if room is not None:
+            room.history.evict(event["id"])
+        if event.get("stored") is False and event.get("writer") == broker.origin:
+            # Not in the table when the admin deleted it; this worker is
+            # writing it and must not let it land there
+            message_writer.remove(event["id"])
+        else:
+            message_writer.cancel(event["id"])
+        if "room" in event:
+            totals.message_removed(event["room"], event["user"], event["date_created"])
+
+    elif kind == "user_changed":
+        auth_cache.invalidate_user(event["id"])
+        if event.get("is_active") is False:
+            # Banned: drop their open sessions on every worker
+            for client in list(rooms.clients()):
+                if client.user_id == event["id"]:
+                    client.close(code=CLOSE_ACCOUNT_DISABLED, reason="Account disabled")
+
+    elif kind == "clear":
+        for room in _target_rooms(event.get("room")):
+            room.history.clear()
+        message_writer.discard(event.get("room"))
+        totals.cleared(event.get("room"))
+
+    elif kind == "user_registered":
+        totals.user_added()
+
+
+def _target_rooms(name: Optional[str]):
+    """The named room if it exists here, or every room when name is None"""
+    if name is None:
+        return list(rooms)
+    room = rooms.get(name, create=False)
+    return [room] if room is not None else []
+
+
+async def broadcast(message: dict, room: Optional[str] = None):
+    """Broadcast message to a room, or every room, on every worker
+
+    Frames are queued per client, so a slow socket never holds up the others.
+    """
+    await broker.publish({"type": "broadcast", "room": room, "message": message})
+
+
+async def broadcast_system_message(text: str, room: Optional[str] = None):
     """Send a system message to all connected clients"""
     msg = {
         "user": "System",
         "text": text,
         "timestamp": datetime.now().isoformat()
     }
-    await broadcast(msg)
-
-
-async def midnight_clear_task():
-    """Clear messages at midnight every day"""
-    db = SessionLocal()
-    last_clear_date = datetime.now().date()
-
-    try:
-        while True:
-            now = datetime.now()
-
-            # Check if it's a new day
-            if now.date() != last_clear_date:
-                # Clear messages at midnight
-                if now.time() >= dt_time(0, 0) and now.time() < dt_time(0, 5):
-                    yesterday = last_clear_date.strftime("%Y-%m-%d")
-                    deleted = db.query(Message).filter(
-                        Message.date_created == yesterday
-                    ).delete()
-                    db.commit()
-
-                    last_clear_date = now.date()
-                    print(f"Messages cleared at midnight: {now} - Deleted {deleted} messages")
-
-                    # Notify all connected clients
-                    await broadcast_system_message("Messages have been cleared for a new day!")
-
-            # Check every minute
-            await asyncio.sleep(60)
-    finally:
-        db.close()
+    await broadcast(msg, room)
 
 
 async def keep_alive_task():
@@ -157,23 +312,21 @@ async def keep_alive_task():
     while True:
         await asyncio.sleep(300)  # Every 5 minutes
 
-        db = SessionLocal()
+        started = time.perf_counter()
         try:
-            today = datetime.now().strftime("%Y-%m-%d")
-            # Only query columns that exist (user_id may not exist in older databases)
-            try:
-                message_count = db.query(Message).filter(Message.date_created == today).count()
-            except Exception as e:
-                # If user_id column doesn't exist, query without it
-                # This handles databases created before user_id was added
-                from sqlalchemy import text
-                result = db.execute(text(
-                    "SELECT COUNT(*) FROM messages WHERE date_created = :date"
-                ), {"date": today})
-                message_count = result.scalar() or 0
-            print(f"[HEARTBEAT] Server alive - {message_count} messages, {len(connected_clients)} clients")
+            message_count = rooms.message_count
+            stats = rooms.connection_stats()
+            writer_stats = message_writer.stats()
+            reaped = supervisor.stats()
+            logger.info(
+                f"Heartbeat - {message_count} messages in {len(rooms.rooms)} rooms, "
+                f"{stats['clients']} clients, "
+                f"{stats['queued_frames']} queued frames (max depth {stats['max_queue_depth']}), "
+                f"{stats['dropped_frames']} dropped, {stats['slow_disconnects']} slow disconnects, "
+                f"{writer_stats['pending']} unsaved messages (lag {writer_stats['lag_seconds']}s), "
+                f"{reaped['reaped_ping_timeout']} unresponsive and {reaped['reaped_idle']} idle connections reaped"
+            )
         except Exception as e:
-            print(f"[HEARTBEAT] Error: {e}")
-        finally:
-            db.close()
+            logger.exception(f"Heartbeat failed: {e}")
+        TASK_SECONDS.labels("heartbeat").observe(time.perf_counter() - started)
 
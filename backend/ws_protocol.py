@@ -0,0 +1,34 @@
+"""Opt-in uvicorn WebSocket protocol with tunable permessage-deflate and keepalive
+
+Run with `uvicorn backend.main:app --ws backend.ws_protocol:WebSocketProtocol`
+to apply the WS_DEFLATE_* and WS_PING_* settings from backend/config.py.
+It subclasses uvicorn's legacy websockets implementation, which is
+deprecated, and sets its private attributes, so it is not the deploy
+default: render.yaml uses `--ws websockets-sansio` with uvicorn's own
+--ws-ping-* and --ws-per-message-deflate flags.
+"""
+from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol as UvicornWebSocketProtocol
+from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+from backend.config import (
+    WS_DEFLATE, WS_DEFLATE_LEVEL, WS_DEFLATE_MEM_LEVEL, WS_DEFLATE_WINDOW_BITS,
+    WS_PING_INTERVAL, WS_PING_TIMEOUT
+)
+
+
+class WebSocketProtocol(UvicornWebSocketProtocol):
+    """uvicorn's websockets protocol with our compression and ping settings"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Protocol-level pings; a missed pong closes the socket with 1011
+        self.ping_interval = WS_PING_INTERVAL or None
+        self.ping_timeout = WS_PING_TIMEOUT or None
+        if WS_DEFLATE:
+            self.available_extensions = [
+                ServerPerMessageDeflateFactory(
+                    server_max_window_bits=WS_DEFLATE_WINDOW_BITS,
+                    compress_settings={"level": WS_DEFLATE_LEVEL, "memLevel": WS_DEFLATE_MEM_LEVEL},
+                )
+            ]
+        else:
+            self.available_extensions = []
@@ -0,0 +1,297 @@
+"""WebSocket load test and latency benchmark
+
+Starts backend.main:app with uvicorn against a throwaway SQLite database,
+connects sender and receiver clients and writes a JSON report with
+throughput, end-to-end delivery latency, history join time and server RSS.
+
+    python benchmarks/ws_bench.py --senders 10 --receivers 90 --rate 200 --duration 20 -o report.json
+
+Compare the reports of two runs to see what a change did.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+
+import websockets
+
+ROOT = Path(__file__).resolve().parent.parent
+BENCH_PREFIX = "bench"
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list (None when empty)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(int(round(pct / 100 * len(ordered))) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def summarize(values):
+    """p50/p95/p99/max/mean of a list of milliseconds"""
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50), 3) if values else None,
+        "p95": round(percentile(values, 95), 3) if values else None,
+        "p99": round(percentile(values, 99), 3) if values else None,
+        "max": round(max(values), 3) if values else None,
+        "mean": round(statistics.fmean(values), 3) if values else None,
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def read_rss(pid: int) -> dict:
+    """Current and peak resident set size of a process in MB (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            fields = dict(line.split(":", 1) for line in status if ":" in line)
+    except OSError:
+        return {"rss_mb": None, "peak_rss_mb": None}
+
+    def to_mb(key):
+        return round(int(fields[key].split()[0]) / 1024, 1) if key in fields else None
+
+    return {"rss_mb": to_mb("VmRSS"), "peak_rss_mb": to_mb("VmHWM")}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_server(args, workdir: str) -> subprocess.Popen:
+    """Run uvicorn in a subprocess with a fresh database"""
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{workdir}/bench.db",
+        "MAX_CONNECTIONS": str(args.senders + args.receivers + 10),
+        # Senders are throttled by --rate, not the per-user limit
+        "MAX_MESSAGES_PER_MINUTE": str(10 ** 6),
+        "GUEST_MESSAGES_PER_MINUTE_PER_IP": str(10 ** 6),
+        # Every client connects from 127.0.0.1
+        "WS_CONNECT_BURST": str(args.senders + args.receivers + 10),
+        "BROKER": "memory",
+    })
+    env.pop("ADMIN_PASSWORD", None)
+    command = [
+        sys.executable, "-m", "uvicorn", "backend.main:app",
+        "--host", "127.0.0.1", "--port", str(args.port),
+        "--ws", "websockets-sansio",
+        "--log-level", "warning",
+    ]
+    log = open(Path(workdir) / "server.log", "w")
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_until_healthy(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Server did not become healthy in time")
+
+
+def messages_in(raw) -> list:
+    """Chat messages in a received frame (single or batched)"""
+    data = json.loads(raw)
+    if isinstance(data, list):
+        return data
+    if data.get("type") in ("history", "ping"):
+        return []
+    return [data]
+
+
+class Receiver:
+    """A client that records when each benchmark message reaches it"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.latencies = []
+        self.join_ms = None
+        self.received = 0
+        self.socket = None
+
+    async def connect(self):
+        started = time.perf_counter()
+        self.socket = await websockets.connect(self.url, max_size=None)
+        await self.socket.recv()  # History replay
+        self.join_ms = (time.perf_counter() - started) * 1000
+
+    async def listen(self):
+        try:
+            async for raw in self.socket:
+                if '"ping"' in raw and json.loads(raw).get("type") == "ping":
+                    await self.socket.send(json.dumps({"type": "pong"}))
+                    continue
+                now = time.perf_counter_ns()
+                for message in messages_in(raw):
+                    parts = message.get("text", "").split(" ")
+                    if len(parts) == 4 and parts[0] == BENCH_PREFIX:
+                        self.received += 1
+                        self.latencies.append((now - int(parts[3])) / 1e6)
+        except websockets.ConnectionClosed:
+            pass
+
+
+async def seed_history(url: str, count: int):
+    """Send `count` messages so joining clients have a history to replay"""
+    async with websockets.connect(url, max_size=None) as ws:
+        await ws.recv()
+        for seq in range(count):
+            await ws.send(json.dumps({"user": "seed", "text": f"seed message {seq}"}))
+        received = 0
+        while received < count:
+            received += len(messages_in(await ws.recv()))
+
+
+async def sender(url: str, name: str, rate: float, duration: float, sent: list):
+    """Send benchmark messages at `rate` per second for `duration` seconds"""
+    async with websockets.connect(url, max_size=None) as ws:
+        drain = asyncio.create_task(_discard(ws))
+        interval = 1 / rate
+        deadline = time.perf_counter() + duration
+        next_send = time.perf_counter()
+        seq = 0
+        while next_send < deadline:
+            await ws.send(json.dumps({
+                "user": name,
+                "text": f"{BENCH_PREFIX} {name} {seq} {time.perf_counter_ns()}"
+            }))
+            seq += 1
+            next_send += interval
+            await asyncio.sleep(max(next_send - time.perf_counter(), 0))
+        sent.append(seq)
+        drain.cancel()
+
+
+async def _discard(ws):
+    try:
+        async for raw in ws:
+            if '"ping"' in raw and json.loads(raw).get("type") == "ping":
+                await ws.send(json.dumps({"type": "pong"}))
+    except websockets.ConnectionClosed:
+        pass
+
+
+async def run(args, pid: int) -> dict:
+    url = f"ws://127.0.0.1:{args.port}/ws" + (f"/{args.room}" if args.room else "")
+
+    if args.history:
+        await seed_history(url, args.history)
+
+    receivers = [Receiver(url) for _ in range(args.receivers)]
+    for start in range(0, len(receivers), 50):
+        await asyncio.gather(*(r.connect() for r in receivers[start:start + 50]))
+    listeners = [asyncio.create_task(r.listen()) for r in receivers]
+    rss_idle = read_rss(pid)
+
+    sent = []
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        sender(url, f"s{index}", args.rate / args.senders, args.duration, sent)
+        for index in range(args.senders)
+    ))
+    send_seconds = time.perf_counter() - started
+    total_sent = sum(sent)
+    expected = total_sent * args.receivers
+
+    # Wait for the tail of the deliveries, up to --drain seconds
+    deadline = time.perf_counter() + args.drain
+    while sum(r.received for r in receivers) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    rss_loaded = read_rss(pid)
+
+    for r in receivers:
+        await r.socket.close()
+    for task in listeners:
+        task.cancel()
+
+    delivered = sum(r.received for r in receivers)
+    latencies = [ms for r in receivers for ms in r.latencies]
+    return {
+        "sent": total_sent,
+        "send_rate": round(total_sent / send_seconds, 1),
+        "delivered": delivered,
+        "expected_deliveries": expected,
+        "delivery_ratio": round(delivered / expected, 4) if expected else None,
+        "deliveries_per_sec": round(delivered / elapsed, 1),
+        "latency_ms": summarize(latencies),
+        "join_ms": summarize([r.join_ms for r in receivers]),
+        "server_memory": {"idle": rss_idle, "loaded": rss_loaded},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--senders", type=int, default=5, help="clients sending messages")
+    parser.add_argument("--receivers", type=int, default=50, help="clients only listening")
+    parser.add_argument("--rate", type=float, default=50, help="total messages per second from all senders")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to send for")
+    parser.add_argument("--drain", type=float, default=5, help="seconds to wait for late deliveries")
+    parser.add_argument("--history", type=int, default=100, help="messages sent before receivers join")
+    parser.add_argument("--room", default="", help="room to use instead of the default one")
+    parser.add_argument("--port", type=int, default=0, help="server port (default: a free port)")
+    parser.add_argument("-o", "--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+    args.port = args.port or free_port()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        server = start_server(args, workdir)
+        try:
+            wait_until_healthy(args.port)
+            results = asyncio.run(run(args, server.pid))
+        finally:
+            server.terminate()
+            server.wait(timeout=10)
+
+    report = {
+        "benchmark": "ws_bench",
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "params": {
+            "senders": args.senders,
+            "receivers": args.receivers,
+            "rate": args.rate,
+            "duration": args.duration,
+            "history": args.history,
+            "room": args.room or None,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+        print(f"Report written to {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
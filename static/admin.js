@@ -87,9 +87,21 @@ document.getElementById('topic-form').addEventListener('submit', async (e) => {
     }
 });
 
-async function loadMessages() {
+// Cursor for the next page of messages (null when there are no more)
+let nextMessagesCursor = null;
+
+async function loadMessages(more = false) {
     try {
-        const response = await fetch(`${API_BASE}/api/admin/messages?limit=50`, {
+        const params = new URLSearchParams({ limit: 50 });
+        const date = document.getElementById('filter-date').value;
+        const user = document.getElementById('filter-user').value.trim();
+        const userId = document.getElementById('filter-user-id').value;
+        if (date) params.set('date', date);
+        if (user) params.set('user', user);
+        if (userId) params.set('user_id', userId);
+        if (more && nextMessagesCursor) params.set('cursor', nextMessagesCursor);
+
+        const response = await fetch(`${API_BASE}/api/admin/messages?${params}`, {
             headers: {
                 'Authorization': `Bearer ${token}`
             }
@@ -97,15 +109,18 @@ async function loadMessages() {
 
         if (!response.ok) throw new Error('Failed to load messages');
 
-        const messages = await response.json();
+        const page = await response.json();
+        const messages = page.items;
         const messageList = document.getElementById('message-list');
+        nextMessagesCursor = page.next_cursor;
+        document.getElementById('load-more-btn').style.display = nextMessagesCursor ? 'inline-block' : 'none';
 
-        if (messages.length === 0) {
+        if (messages.length === 0 && !more) {
             messageList.innerHTML = '<p style="color: #00aa00;">No messages found</p>';
             return;
         }
 
-        messageList.innerHTML = messages.map(msg => `
+        const html = messages.map(msg => `
             <div class="message-item">
                 <div class="message-content">
                     <div class="message-meta">
@@ -116,6 +131,11 @@ async function loadMessages() {
                 <button class="delete-btn" onclick="deleteMessage(${msg.id})">Delete</button>
             </div>
         `).join('');
+        if (more) {
+            messageList.insertAdjacentHTML('beforeend', html);
+        } else {
+            messageList.innerHTML = html;
+        }
     } catch (error) {
         console.error('Failed to load messages:', error);
         showError('Failed to load messages');
@@ -200,24 +200,142 @@ async function loadHeadline() {
 // Determine WS URL (works locally & on Render)
 const loc = window.location;
 let wsProtocol = loc.protocol === "https:" ? "wss:" : "ws:";
+// Optional room from ?room=name; the default room is plain /ws
+const room = new URLSearchParams(loc.search).get("room");
 let wsUrl = `${wsProtocol}//${loc.host}/ws`;
+if (room) {
+  wsUrl += `/${encodeURIComponent(room.toLowerCase())}`;
+}
+
+// History paging state
+let oldestMessageId = null;
+let hasMoreHistory = false;
+let loadingOlder = false;
+
+// Reconnect state: resume from the last message id we saw
+let lastMessageId = null;
+let reconnectAttempts = 0;
+const RECONNECT_BASE_MS = 500;
+const RECONNECT_MAX_MS = 30000;
+
+let ws = null;
+
+function connect() {
+  const url = lastMessageId === null ? wsUrl : `${wsUrl}?since=${lastMessageId}`;
+  // Signed-in users send their token as a subprotocol (kept out of the URL and logs)
+  ws = authToken
+    ? new WebSocket(url, ["rageroom.json", `rageroom.bearer.${authToken}`])
+    : new WebSocket(url);
+
+  ws.onopen = () => {
+    console.log("WebSocket connected");
+    reconnectAttempts = 0;
+    // Message history (or just what we missed) is sent by the server
+  };
+
+  ws.onmessage = (event) => {
+    const data = JSON.parse(event.data);
+    console.log("Received message:", data);
+
+    if (data.type === "history") {
+      handleHistory(data);
+      return;
+    }
+
+    // Liveness check from the server
+    if (data.type === "ping") {
+      ws.send(JSON.stringify({ type: "pong" }));
+      return;
+    }
+
+    // Bursts (and a slow client's backlog) may arrive as one batched array frame;
+    // the server never batches control frames, but don't render one as chat
+    const messages = Array.isArray(data) ? data : [data];
+    messages.filter((message) => !message.type).forEach(addMessage);
+  };
+
+  ws.onclose = (event) => {
+    console.log("WebSocket closed", event.code);
+    if (event.code === 4401) {
+      // Expired or invalid token: carry on as a guest
+      localStorage.removeItem('access_token');
+      localStorage.removeItem('user');
+      authToken = null;
+      currentUser = null;
+      showLoginLink();
+    } else if (event.code === 4403) {
+      addMessage({ user: "System", text: "Your account has been disabled." });
+      return;
+    } else if (event.code === 1001 && event.reason === "Idle timeout") {
+      // Closed for inactivity: stay away until the page is used again
+      reconnectWhenActive();
+      return;
+    }
+    scheduleReconnect();
+  };
+}
+
+const ACTIVITY_EVENTS = ["focus", "keydown", "scroll", "pointerdown"];
+
+function reconnectWhenActive() {
+  const resume = () => {
+    ACTIVITY_EVENTS.forEach((name) => window.removeEventListener(name, resume, true));
+    reconnectAttempts = 0;
+    connect();  // with ?since=, so only the missed messages are replayed
+  };
+  // Capture phase, so scrolling the chat window counts too
+  ACTIVITY_EVENTS.forEach((name) => window.addEventListener(name, resume, true));
+}
 
-const ws = new WebSocket(wsUrl);
+function scheduleReconnect() {
+  // Exponential backoff with full jitter, so a restart doesn't bring
+  // every client back at the same instant
+  const ceiling = Math.min(RECONNECT_MAX_MS, RECONNECT_BASE_MS * 2 ** reconnectAttempts);
+  const delay = Math.random() * ceiling;
+  reconnectAttempts += 1;
+  console.log(`Reconnecting in ${Math.round(delay)} ms`);
+  setTimeout(connect, delay);
+}
 
-ws.onopen = () => {
-  console.log("WebSocket connected");
-  // Message history will be sent automatically by the server
-};
+connect();
 
-ws.onmessage = (event) => {
-  const msg = JSON.parse(event.data);
-  console.log("Received message:", msg);
-  addMessage(msg);
-};
+function handleHistory(data) {
+  if (data.since !== null && data.since !== undefined) {
+    // Reconnected - only the messages we missed, paging state is unchanged
+    data.messages.forEach(addMessage);
+    return;
+  }
 
-ws.onclose = () => {
-  console.log("WebSocket closed");
-};
+  hasMoreHistory = data.has_more;
+  loadingOlder = false;
+  if (data.messages.length > 0) {
+    oldestMessageId = data.messages[0].id;
+  }
+
+  if (data.before === null) {
+    // Full replay on connect (or after too long away) replaces what we have
+    chatWindow.innerHTML = "";
+    oldestMessageId = data.messages.length > 0 ? data.messages[0].id : null;
+    data.messages.forEach(addMessage);
+    return;
+  }
+
+  // Older page - prepend and keep the current scroll position
+  const previousHeight = chatWindow.scrollHeight;
+  const fragment = document.createDocumentFragment();
+  data.messages.forEach(msg => fragment.appendChild(createMessageElement(msg)));
+  chatWindow.insertBefore(fragment, chatWindow.firstChild);
+  chatWindow.scrollTop = chatWindow.scrollHeight - previousHeight;
+}
+
+// Load older messages when scrolled to the top
+chatWindow.addEventListener("scroll", () => {
+  if (chatWindow.scrollTop > 0 || !hasMoreHistory || loadingOlder || oldestMessageId === null) return;
+  if (ws.readyState !== WebSocket.OPEN) return;
+
+  loadingOlder = true;
+  ws.send(JSON.stringify({ type: "load_older", before: oldestMessageId }));
+});
 
 function sendMessage() {
   const text = input.value.trim();
@@ -229,6 +347,7 @@ function sendMessage() {
     timestamp: new Date().toISOString(),
   };
 
+  if (ws.readyState !== WebSocket.OPEN) return;
   ws.send(JSON.stringify(msg));
   input.value = "";
 }
@@ -241,6 +360,14 @@ input.addEventListener("keydown", (e) => {
 });
 
 function addMessage(msg) {
+  if (msg.id !== undefined && msg.id !== null) {
+    lastMessageId = Math.max(lastMessageId ?? 0, msg.id);
+  }
+  chatWindow.appendChild(createMessageElement(msg));
+  chatWindow.scrollTop = chatWindow.scrollHeight;
+}
+
+function createMessageElement(msg) {
   const div = document.createElement("div");
   div.className = "chat-message";
 
@@ -255,8 +382,7 @@ function addMessage(msg) {
   div.appendChild(userSpan);
   div.appendChild(textSpan);
 
-  chatWindow.appendChild(div);
-  chatWindow.scrollTop = chatWindow.scrollHeight;
+  return div;
 }
 
 // Initialize
@@ -0,0 +1,110 @@
+"""Unix socket broker across worker processes, including hub failover"""
+import asyncio
+import multiprocessing
+import time
+
+from backend.broker import UnixSocketBroker
+
+ctx = multiprocessing.get_context("fork")
+
+
+async def _worker_main(path: str, commands):
+    """Run a broker and answer commands from the test over a pipe"""
+    received = []
+    next_id = 1
+
+    def sequence() -> int:
+        # Like MessageWriter.allocate_id: a counter kept ahead of every id seen
+        nonlocal next_id
+        next_id += 1
+        return next_id - 1
+
+    def handle(event: dict):
+        nonlocal next_id
+        if event["type"] == "message":
+            next_id = max(next_id, event["id"] + 1)
+            received.append((event["id"], event["text"]))
+
+    broker = UnixSocketBroker(path)
+    await broker.start(handle, sequence)
+    commands.send("started")
+    loop = asyncio.get_running_loop()
+    while True:
+        command, argument = await loop.run_in_executor(None, commands.recv)
+        if command == "publish":
+            for text in argument:
+                await broker.publish({"type": "message", "id": None, "text": text})
+            commands.send(None)
+        elif command == "received":
+            commands.send(received)
+        elif command == "stats":
+            commands.send(broker.stats())
+        elif command == "stop":
+            await broker.stop()
+            commands.send(None)
+            return
+
+
+def _worker(path: str, commands):
+    asyncio.run(_worker_main(path, commands))
+
+
+class Worker:
+    def __init__(self, path: str):
+        self.pipe, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker, args=(path, child), daemon=True)
+        self.process.start()
+        assert self.pipe.poll(10), "worker did not start"
+        assert self.pipe.recv() == "started"
+
+    def call(self, command: str, argument=None):
+        self.pipe.send((command, argument))
+        assert self.pipe.poll(10), f"worker did not answer {command}"
+        return self.pipe.recv()
+
+    def wait_for(self, count: int, timeout: float = 10) -> list:
+        deadline = time.monotonic() + timeout
+        while True:
+            received = self.call("received")
+            if len(received) >= count or time.monotonic() > deadline:
+                return received
+            time.sleep(0.05)
+
+
+def test_hub_failover_keeps_one_order(tmp_path):
+    path = str(tmp_path / "broker.sock")
+    hub = Worker(path)  # First to start takes the lock and runs the hub
+    peers = [Worker(path), Worker(path)]
+    assert hub.call("stats")["hub"]
+    assert not any(peer.call("stats")["hub"] for peer in peers)
+
+    try:
+        for index, worker in enumerate([hub] + peers):
+            worker.call("publish", [f"before {index}.{n}" for n in range(20)])
+        before = [worker.wait_for(60) for worker in [hub] + peers]
+        assert all(received == before[0] for received in before)
+        assert len(before[0]) == 60
+
+        hub.process.kill()
+        hub.process.join(timeout=10)
+
+        # Published while there is no hub: queued, then sent to the new one
+        for index, peer in enumerate(peers):
+            peer.call("publish", [f"after {index}.{n}" for n in range(20)])
+        after = [peer.wait_for(100) for peer in peers]
+
+        assert sum(peer.call("stats")["hub"] for peer in peers) == 1
+        assert after[0] == after[1]
+        assert after[0][:60] == before[0]
+        ids = [message_id for message_id, _ in after[0]]
+        assert ids == sorted(set(ids))
+        texts = [text for _, text in after[0]]
+        for index in range(2):
+            # Every message arrives once, in the order it was published
+            sent = [f"after {index}.{n}" for n in range(20)]
+            assert [text for text in texts if text in sent] == sent
+    finally:
+        for peer in peers:
+            if peer.process.is_alive():
+                peer.call("stop")
+                peer.process.join(timeout=10)
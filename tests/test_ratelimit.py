@@ -0,0 +1,34 @@
+"""Shared rate limiter across processes"""
+import multiprocessing
+
+from backend.ratelimit import SharedTokenBucketLimiter
+
+# Workers are forked, like uvicorn's, so they share nothing but the file
+ctx = multiprocessing.get_context("fork")
+
+BURST = 2000
+WORKERS = 4
+
+
+def _spend(path, barrier, results):
+    limiter = SharedTokenBucketLimiter("test", rate=0, burst=BURST, path=path, max_keys=64)
+    barrier.wait()
+    allowed = sum(limiter.allow("user:1") for _ in range(BURST))
+    results.put((allowed, len(limiter)))
+
+
+def test_processes_share_one_burst(tmp_path):
+    path = str(tmp_path / "limiter")
+    barrier = ctx.Barrier(WORKERS)
+    results = ctx.Queue()
+    workers = [ctx.Process(target=_spend, args=(path, barrier, results)) for _ in range(WORKERS)]
+    for worker in workers:
+        worker.start()
+    outcomes = [results.get(timeout=10) for _ in workers]
+    for worker in workers:
+        worker.join(timeout=10)
+        assert worker.exitcode == 0
+
+    # All went at the same key at once; together they got one burst
+    assert sum(allowed for allowed, _ in outcomes) == BURST
+    assert all(keys == 1 for _, keys in outcomes)